@@ -0,0 +1,801 @@
+
+import os
+import sys
+import json
+import time
+import random
+import fnmatch
+import difflib
+import base64
+import shutil
+import argparse
+import socket
+import tempfile
+import threading
+import http.client
+import asyncio
+import platform
+import contextlib
+import tracemalloc
+import subprocess
+from itertools import islice
+
+# -------------------------------------------------------
+#  GENCLAUDE SYNC SERVER BENCHMARKS
+# -------------------------------------------------------
+#  Runs against sync_server.py in-process on a synthetic project tree.
+#  Usage: python sync_bench.py index --files 200000 --workers 8
+#         python sync_bench.py --files 50000 --out new.json --compare old.json
+
+import sync_server as server
+
+# --- Synthetic Tree ---
+SOURCE_EXTS = ['.kt', '.java', '.py', '.js', '.ts', '.md', '.json', '.xml']
+NOISE_EXTS = ['.png', '.class', '.log', '.tmp']
+NOISE_DIRS = ['node_modules', '.gradle', 'build', '.git']
+WORDS = ['val', 'fun', 'return', 'if', 'else', 'import', 'class', 'override', 'private', 'String', 'Int', 'null',
+         'view', 'context', 'adapter', 'items', 'position', 'listener', 'state', 'update', 'render', 'config']
+
+def code_line(rng):
+    return ' ' * rng.choice((0, 4, 8)) + ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 8))) + f" {rng.choice(WORDS)}{rng.randint(0, 9999)}"
+
+def make_tree(root, files, depth=4, fanout=6, noise=0.2, seed=1):
+    """
+    Creates `files` source files spread over a tree of the given depth and
+    fanout. Roughly `noise` of them land in ignored dirs or have ignored
+    extensions, like a real Android/JS checkout.
+    """
+    rng = random.Random(seed)
+    dirs = [""]
+    frontier = [""]
+    for _ in range(depth):
+        next_frontier = []
+        for d in frontier:
+            for i in range(fanout):
+                sub = f"{d}/pkg{i}" if d else f"pkg{i}"
+                next_frontier.append(sub)
+        dirs.extend(next_frontier)
+        frontier = next_frontier
+    noise_dirs = [f"{d}/{rng.choice(NOISE_DIRS)}" if d else rng.choice(NOISE_DIRS) for d in rng.sample(dirs, max(1, len(dirs) // 10))]
+
+    made = set()
+    for i in range(files):
+        if rng.random() < noise:
+            if rng.random() < 0.5:
+                d, name = rng.choice(noise_dirs), f"dep{i}.js"
+            else:
+                d, name = rng.choice(dirs), f"asset{i}{rng.choice(NOISE_EXTS)}"
+        else:
+            d, name = rng.choice(dirs), f"File{i}{rng.choice(SOURCE_EXTS)}"
+        full_dir = os.path.join(root, d)
+        if full_dir not in made:
+            os.makedirs(full_dir, exist_ok=True)
+            made.add(full_dir)
+        with open(os.path.join(full_dir, name), 'w') as f:
+            body, size = [], rng.randint(0, 2000)
+            while size > 0:
+                body.append(code_line(rng))
+                size -= len(body[-1]) + 1
+            f.write(f"// {name}\n" + "\n".join(body))
+    return root
+
+ROOT = None  # the server.Root being benchmarked
+
+def use_root(path):
+    global ROOT
+    server.ROOTS.clear()
+    ROOT = server.add_root('bench', path)
+    ROOT.ignore_dirs.update(server.DEFAULT_IGNORE_DIRS)
+    ROOT.custom_patterns.update({'*~', '*.tmp'})
+    server.rebuild_ignore_matcher(ROOT)
+    return ROOT
+
+# --- Reference Implementations ---
+def legacy_is_path_excluded(root, rel_path):
+    """The original per-pattern fnmatch loop, kept as the reference for IgnoreMatcher."""
+    parts = rel_path.replace("\\", "/").split("/")
+    for pattern in root.custom_patterns:
+        if pattern in rel_path or fnmatch.fnmatch(rel_path, pattern): return True
+        if fnmatch.fnmatch(os.path.basename(rel_path), pattern): return True
+
+    accum = ""
+    for part in parts:
+        accum = f"{accum}/{part}" if accum else part
+        if accum in root.excluded_paths: return True
+        if part in root.ignore_dirs or part.lower() in root.ignore_dirs: return True
+    return False
+
+def legacy_walk(top):
+    """The original os.walk + relpath indexer, kept as the baseline."""
+    new_index = {}
+    for root, dirs, filenames in os.walk(top):
+        rel_dir = server.get_relative_path(ROOT, root)
+        if rel_dir == ".": rel_dir = ""
+        dirs[:] = [d for d in dirs if d not in ROOT.ignore_dirs and d.lower() not in ROOT.ignore_dirs and not d.startswith('.') and not server.is_path_excluded(ROOT, os.path.join(rel_dir, d).replace("\\", "/"))]
+        for name in filenames:
+            path = os.path.join(root, name)
+            rel_path = server.get_relative_path(ROOT, path)
+            if server.is_valid_file(ROOT, path, rel_path):
+                try:
+                    stats = os.stat(path)
+                    if stats.st_size <= server.CONFIG['MAX_FILE_SIZE']:
+                        new_index[rel_path] = { "size": stats.st_size, "mtime": stats.st_mtime }
+                except: pass
+    return new_index
+
+# --- Benchmarks ---
+def timed(fn, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def bench_index(args):
+    matcher = server.is_path_excluded
+    server.is_path_excluded = legacy_is_path_excluded
+    try: legacy_time, legacy = timed(lambda: legacy_walk(ROOT.dir), args.repeat)
+    finally: server.is_path_excluded = matcher
+    results = {"files_indexed": len(legacy), "legacy": {"seconds": legacy_time, "files_per_sec": len(legacy) / legacy_time}}
+    for workers in args.workers:
+        t, index = timed(lambda: server.walk_tree(ROOT, "", workers=workers), args.repeat)
+        if index != legacy: raise SystemExit(f"walk_tree(workers={workers}) disagrees with the legacy walker")
+        results[f"scandir_w{workers}"] = {"seconds": t, "files_per_sec": len(index) / t, "speedup": legacy_time / t}
+    return results
+
+def random_paths(rng, count):
+    """Paths built to hit the corners of the ignore rules: case, separators, patterns as substrings."""
+    atoms = ['src', 'app', 'Node_Modules', 'node_modules', 'build', 'BUILD', 'main', 'a', '', '.git', 'x.tmp', 'y~',
+             '*.tmp', 'android', 'res', 'notes.md', 'sync_server.py', 'bin', 'Bin', 'docs', 'gen', '.gradle']
+    paths = []
+    for _ in range(count):
+        parts = [rng.choice(atoms) for _ in range(rng.randint(1, 6))]
+        sep = '\\' if rng.random() < 0.1 else '/'
+        path = sep.join(parts)
+        if rng.random() < 0.05: path = '/' + path
+        paths.append(path)
+    return paths
+
+def bench_ignore(args):
+    rng = random.Random(7)
+    # The extra rules are only for this benchmark; later ones run with the root's own
+    saved = set(ROOT.excluded_paths), set(ROOT.custom_patterns)
+    try:
+        ROOT.excluded_paths.update({'docs/notes.md', 'app/build/x', 'sync_server.py', 'src/', 'a//a'})
+        ROOT.custom_patterns.update({'gen*', '*/res/*.md'})
+        server.rebuild_ignore_matcher(ROOT)
+
+        paths = random_paths(rng, 50000)
+        for rel_path in paths:
+            if server.is_path_excluded(ROOT, rel_path) != legacy_is_path_excluded(ROOT, rel_path):
+                raise SystemExit(f"IgnoreMatcher disagrees with the legacy matcher on {rel_path!r}")
+
+        tree_paths = list(legacy_walk(ROOT.dir)) + paths
+        legacy_time, _ = timed(lambda: [legacy_is_path_excluded(ROOT, p) for p in tree_paths], args.repeat)
+        compiled_time, _ = timed(lambda: [server.is_path_excluded(ROOT, p) for p in tree_paths], args.repeat)
+        return {
+            "paths": len(tree_paths),
+            "equivalence_checked": len(paths),
+            "legacy": {"seconds": legacy_time, "paths_per_sec": len(tree_paths) / legacy_time},
+            "compiled": {"seconds": compiled_time, "paths_per_sec": len(tree_paths) / compiled_time, "speedup": legacy_time / compiled_time}
+        }
+    finally:
+        ROOT.excluded_paths.clear(); ROOT.excluded_paths.update(saved[0])
+        ROOT.custom_patterns.clear(); ROOT.custom_patterns.update(saved[1])
+        server.rebuild_ignore_matcher(ROOT)
+
+def percentile(values, pct):
+    if not values: return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def start_http_server():
+    """Serves the Flask app on an ephemeral port in a background thread."""
+    from werkzeug.serving import make_server
+    httpd = make_server('127.0.0.1', 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+def start_async_server():
+    """Serves the app with AsyncServer on an ephemeral port in a background event loop."""
+    httpd = server.AsyncServer(server.app, '127.0.0.1', 0, server.CONFIG['HTTP_WORKERS'])
+    ready = threading.Event()
+    async def serve():
+        await httpd.start()
+        ready.set()
+        async with httpd.server: await httpd.server.serve_forever()
+    def run():
+        try: asyncio.run(serve())
+        except asyncio.CancelledError: pass
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    httpd.server_port = httpd.port
+    httpd.shutdown = lambda: httpd.loop.call_soon_threadsafe(httpd.server.close)
+    return httpd
+
+class SSEClient(threading.Thread):
+    """Reads /api/events and records delivery latency for every change event."""
+    def __init__(self, port):
+        super().__init__(daemon=True)
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self.conn.request('GET', '/api/events')
+        self.sock = self.conn.sock
+        self.resp = self.conn.getresponse()
+        self.events = 0
+        self.resyncs = 0
+        self.latencies = []
+        self.last_seen = time.time()
+
+    def run(self):
+        try:
+            for line in self.resp.fp:
+                if not line.startswith(b'data: '): continue
+                now = time.time()
+                data = json.loads(line[6:])
+                self.last_seen = now
+                if data.get('type') == 'resync':
+                    self.resyncs += 1
+                else:
+                    self.events += len(data['events']) if data.get('type') == 'batch' else 1
+                    self.latencies.append(now - data['timestamp'])
+        except (OSError, ValueError): pass
+
+    def close(self):
+        try: self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError: pass
+        self.conn.close()
+
+def churn_files(paths, rng):
+    """Rewrites every path once, like a branch switch touching them."""
+    for rel_path in paths:
+        with open(os.path.join(ROOT.dir, rel_path), 'a') as f:
+            f.write(f"\n// churn {rng.random()}")
+
+def bench_sse(args):
+    if not server.HAS_WATCHDOG: return {"skipped": "watchdog not installed"}
+    rng = random.Random(3)
+    server.build_index(ROOT)
+    observer = server.start_observer()
+    httpd = start_http_server()
+    clients = [SSEClient(httpd.server_port) for _ in range(args.clients)]
+    for c in clients: c.start()
+    try:
+        with ROOT.lock: paths = sorted(ROOT.index)
+        paths = rng.sample(paths, min(args.churn, len(paths)))
+        published_before = server.EVENT_HUB.last_seq
+        events_before = server.EVENT_COALESCER.stats(ROOT)
+        start = time.perf_counter()
+        churn_files(paths, rng)
+        churn_time = time.perf_counter() - start
+
+        # Wait until every client has been quiet for a while
+        for c in clients: c.last_seen = time.time()
+        while time.time() - max(c.last_seen for c in clients) < 2: time.sleep(0.2)
+        published = server.EVENT_HUB.last_seq - published_before
+        events_after = server.EVENT_COALESCER.stats(ROOT)
+    finally:
+        for c in clients: c.close()
+        httpd.shutdown()
+        observer.stop(); observer.join()
+
+    latencies = [l for c in clients for l in c.latencies]
+    return {
+        "clients": len(clients),
+        "files_churned": len(paths),
+        "churn_seconds": churn_time,
+        "raw_fs_events": events_after["raw"] - events_before["raw"],
+        "changes_published": events_after["coalesced"] - events_before["coalesced"],
+        "sse_messages": published,
+        "events_received_min": min(c.events for c in clients),
+        "events_received_max": max(c.events for c in clients),
+        "clients_resynced": sum(1 for c in clients if c.resyncs),
+        "latency_p50_ms": (percentile(latencies, 50) or 0) * 1000,
+        "latency_p99_ms": (percentile(latencies, 99) or 0) * 1000
+    }
+
+SEARCH_QUERIES = [
+    {"name": "rare_literal", "query": "// File1234."},
+    {"name": "identifier", "query": "adapter42"},
+    {"name": "common_words", "query": "return null"},
+    {"name": "ignore_case", "query": "STRING view", "ignore_case": True},
+    {"name": "regex_literals", "query": r"items \w+ listener\d+$", "regex": True},
+    {"name": "regex_no_literal", "query": r"\bIn\w \w{2}\b", "regex": True},
+]
+
+def wait_for(check, timeout=300):
+    start = time.perf_counter()
+    while not check():
+        if time.perf_counter() - start > timeout: return None
+        time.sleep(0.05)
+    return time.perf_counter() - start
+
+def bench_poll(args):
+    """Polling scanner: idle CPU share, and how long creates (dir pass) and in-place edits (file sweep) take to show up."""
+    rng = random.Random(5)
+    server.build_index(ROOT)
+    server.CONFIG['POLL_STAT_RATE'] = args.poll_rate
+    server.start_poller(force=True)
+    try:
+        cpu, wall = time.process_time(), time.perf_counter()
+        time.sleep(3)
+        idle_cpu = (time.process_time() - cpu) / (time.perf_counter() - wall)
+
+        with ROOT.lock:
+            paths = sorted(ROOT.index)
+            dirs = len(ROOT.dir_mtimes)
+        count = min(args.churn, 200, len(paths))
+        created = [f"{p.rpartition('/')[0]}/polled{i}.txt".lstrip('/') for i, p in enumerate(rng.sample(paths, count))]
+        for rel_path in created:
+            with open(os.path.join(ROOT.dir, rel_path), 'w') as f: f.write("new")
+        create_seconds = wait_for(lambda: all(p in ROOT.index for p in created))
+
+        edited = rng.sample(paths, count)
+        before = {p: ROOT.index.stats(p) for p in edited}
+        time.sleep(0.01)
+        churn_files(edited, rng)
+        edit_seconds = wait_for(lambda: all(ROOT.index.stats(p) != before[p] for p in edited))
+        scanner = ROOT.poller.stats()
+    finally:
+        # Left running, the poller would skew every benchmark after this one
+        server.stop_poller()
+    return {
+        "stat_rate": args.poll_rate,
+        "dirs": dirs,
+        "files": len(paths),
+        "idle_cpu_fraction": idle_cpu,
+        "files_created": count,
+        "create_detect_seconds": create_seconds,
+        "files_edited": count,
+        "edit_detect_seconds": edit_seconds,
+        "scanner": scanner
+    }
+
+def bench_search(args):
+    # Files the trigram index skips (over SEARCH_MAX_FILE_BYTES, or binary) must still be found
+    skipped = {'bench-search/small.kt': "needleword\n",
+               'bench-search/large.kt': "needleword\n" + "x" * (server.CONFIG['SEARCH_MAX_FILE_BYTES'] + 1024) + "\n",
+               'bench-search/nul.kt': "\0needleword\n"}
+    os.makedirs(os.path.join(ROOT.dir, 'bench-search'), exist_ok=True)
+    for rel_path, content in skipped.items():
+        with open(os.path.join(ROOT.dir, rel_path), 'w') as f: f.write(content)
+    try:
+        server.build_index(ROOT)
+        ROOT.search.enabled = True
+        start = time.perf_counter()
+        ROOT.search._rebuild()
+        results = {"build_seconds": time.perf_counter() - start, "index": ROOT.search.stats(), "queries": {}}
+        client = server.app.test_client()
+        for spec in SEARCH_QUERIES + [{"name": "skipped_files", "query": "needleword"}]:
+            body = {k: v for k, v in spec.items() if k != 'name'}
+            t, reply = timed(lambda: client.post('/api/search', json=body).json, args.repeat)
+            ROOT.search.ready = False
+            try: scan_t, scan = timed(lambda: client.post('/api/search', json=body).json, args.repeat)
+            finally: ROOT.search.ready = True
+            if reply["matches"] != scan["matches"]: raise SystemExit(f"Indexed search disagrees with a full scan for {spec['name']}")
+            results["queries"][spec["name"]] = {"ms": t * 1000, "full_scan_ms": scan_t * 1000, "matches": len(reply["matches"]),
+                                                "candidates": reply["candidates"], "used_index": reply["used_index"]}
+        if {m["path"] for m in reply["matches"]} != set(skipped): raise SystemExit("Search missed files the trigram index skipped")
+        return results
+    finally:
+        shutil.rmtree(os.path.join(ROOT.dir, 'bench-search'), ignore_errors=True)
+        server.build_index(ROOT)
+
+def load_worker(port, paths, deadline, latencies, errors, seed):
+    """Keep-alive client alternating single reads and list pages until the deadline."""
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    while time.time() < deadline:
+        if rng.random() < 0.8: method, url, body = 'POST', '/api/read', json.dumps({"path": rng.choice(paths)})
+        else: method, url, body = 'GET', f"/api/list?limit=200&after={rng.choice(paths)}", None
+        start = time.perf_counter()
+        try:
+            conn.request(method, url, body=body, headers={'Content-Type': 'application/json'})
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status != 200: errors.append(resp.status)
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            conn.close()
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+def bench_server(args):
+    """Same request mix against the threaded Werkzeug server and AsyncServer, with idle SSE clients attached."""
+    server.build_index(ROOT)
+    with ROOT.lock: paths = sorted(ROOT.index)
+    results = {}
+    for mode, start in (('threaded', start_http_server), ('asyncio', start_async_server)):
+        httpd = start()
+        clients = [SSEClient(httpd.server_port) for _ in range(args.clients)]
+        for c in clients: c.start()
+        latencies, errors = [], []
+        deadline = time.time() + args.duration
+        workers = [threading.Thread(target=load_worker, args=(httpd.server_port, paths, deadline, latencies, errors, i), daemon=True)
+                   for i in range(args.concurrency)]
+        for w in workers: w.start()
+        # Probe events measure SSE delivery while the request load runs
+        while time.time() < deadline - 0.2:
+            server.EVENT_HUB.publish({"type": "probe", "timestamp": time.time()})
+            time.sleep(0.1)
+        threads = threading.active_count()
+        for w in workers: w.join()
+        for c in clients: c.close()
+        httpd.shutdown()
+        sse = [l for c in clients for l in c.latencies]
+        results[mode] = {
+            "requests": len(latencies),
+            "requests_per_sec": len(latencies) / args.duration,
+            "latency_p50_ms": (percentile(latencies, 50) or 0) * 1000,
+            "latency_p99_ms": (percentile(latencies, 99) or 0) * 1000,
+            "errors": len(errors),
+            "sse_clients": len(clients),
+            "sse_latency_p50_ms": (percentile(sse, 50) or 0) * 1000,
+            "sse_latency_p99_ms": (percentile(sse, 99) or 0) * 1000,
+            "process_threads": threads
+        }
+        time.sleep(0.5)
+    results["asyncio_vs_threaded_rps"] = results["asyncio"]["requests_per_sec"] / max(results["threaded"]["requests_per_sec"], 1e-9)
+    return results
+
+def measure_memory(build):
+    """Bytes still allocated by build()'s result, per tracemalloc."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used, result
+
+def bench_memory(args):
+    """Steady-state memory of the file index: the old dict of dicts vs FileIndex."""
+    walked = server.walk_tree(ROOT, "")
+    rows = [(path, v["size"], v["mtime"]) for path, v in walked.items()]
+    del walked
+    # Fresh path strings, as a real walk would allocate them
+    def legacy():
+        return {''.join(path): {"size": size, "mtime": mtime} for path, size, mtime in rows}
+    def compact():
+        index = server.FileIndex()
+        for path, size, mtime in rows: index.put(''.join(path), size, mtime)
+        return index
+    legacy_bytes, legacy_index = measure_memory(legacy)
+    compact_bytes, compact_index = measure_memory(compact)
+    if sorted(compact_index.iter_stats()) != sorted((k, v["size"], v["mtime"]) for k, v in legacy_index.items()):
+        raise SystemExit("FileIndex disagrees with the dict index")
+    for rel_dir in ['', *islice(compact_index.dirs, 200)]:
+        expected = sorted(k for k in legacy_index if not rel_dir or k.startswith(rel_dir + '/'))
+        if sorted(compact_index.paths_under(rel_dir)) != expected: raise SystemExit(f"FileIndex.paths_under({rel_dir!r}) disagrees with the dict index")
+    files = len(rows)
+    return {
+        "files": files,
+        "dirs": len(compact_index.dirs),
+        "dict_index": {"bytes": legacy_bytes, "bytes_per_file": legacy_bytes / files},
+        "file_index": {"bytes": compact_bytes, "bytes_per_file": compact_bytes / files},
+        "saved_per_file": (legacy_bytes - compact_bytes) / files,
+        "ratio": legacy_bytes / compact_bytes
+    }
+
+def reset_cache():
+    server.CONTENT_CACHE = server.ContentCache(server.CONFIG['CACHE_BYTES'])
+
+def bench_io(args):
+    """List, read and batch-read throughput through the Flask app, cold and warm cache."""
+    server.build_index(ROOT)
+    client = server.app.test_client()
+    with ROOT.lock: paths = sorted(ROOT.index)
+    sample = random.Random(4).sample(paths, min(args.reads, len(paths)))
+    results = {"files_indexed": len(paths)}
+
+    def full_listing():
+        return len(client.get('/api/list').json["files"])
+    t, count = timed(full_listing, args.repeat)
+    results["list_full"] = {"seconds": t, "files_per_sec": count / t}
+
+    def paged_listing():
+        count, after, cursor = 0, '', ''
+        while True:
+            page = client.get(f"/api/list?limit={server.CONFIG['LIST_PAGE_SIZE']}&after={after}&cursor={cursor}").json
+            count += len(page["files"])
+            after, cursor = page["next"], page["cursor"]
+            if not after: return count
+    t, count = timed(paged_listing, args.repeat)
+    results["list_paged"] = {"seconds": t, "files_per_sec": count / t}
+
+    def reads():
+        nbytes = 0
+        for rel_path in sample: nbytes += len(client.post('/api/read', json={"path": rel_path}).json["content"])
+        return nbytes
+    for label in ('read_cold', 'read_warm'):
+        if label == 'read_cold': reset_cache()
+        start = time.perf_counter()
+        nbytes = reads()
+        t = time.perf_counter() - start
+        results[label] = {"seconds": t, "reads_per_sec": len(sample) / t, "mb_per_sec": nbytes / t / 1e6}
+
+    batches = [sample[i:i + args.batch] for i in range(0, len(sample), args.batch)]
+    for label, headers in (('batch_read_json', {}), ('batch_read_ndjson', {'Accept': 'application/x-ndjson'})):
+        reset_cache()
+        start = time.perf_counter()
+        for batch in batches:
+            resp = client.post('/api/batch-read', json={"paths": batch}, headers=headers)
+            resp.get_data()
+        t = time.perf_counter() - start
+        results[label] = {"seconds": t, "files_per_sec": len(sample) / t, "batch_size": args.batch}
+    return results
+
+def bench_range(args):
+    """Line-range reads from a large log: first read (builds the line index) and random windows after it."""
+    rel_path = 'genclaude-bench-range.log'
+    full_path = os.path.join(ROOT.dir, rel_path)
+    rng = random.Random(args.seed)
+    lines = 0
+    with open(full_path, 'w') as f:
+        while f.tell() < args.range_mb * 1024 * 1024:
+            f.write('\n'.join(f"{lines + i} {code_line(rng)}" for i in range(10000)) + '\n')
+            lines += 10000
+    try:
+        client = server.app.test_client()
+        window = 200
+        start = time.perf_counter()
+        reply = client.post('/api/read-range', json={"path": rel_path, "start_line": lines // 3, "end_line": lines // 3 + window}).json
+        first = time.perf_counter() - start
+        if reply["total_lines"] != lines: raise SystemExit(f"Line index counted {reply['total_lines']} lines, wrote {lines}")
+        latencies = []
+        for _ in range(args.reads):
+            line = rng.randint(1, lines - window)
+            start = time.perf_counter()
+            reply = client.post('/api/read-range', json={"path": rel_path, "start_line": line, "end_line": line + window - 1}).json
+            latencies.append(time.perf_counter() - start)
+            if not reply["content"].startswith(f"{line - 1} "): raise SystemExit(f"Range read of line {line} returned the wrong line")
+        start = time.perf_counter()
+        with open(full_path, 'rb') as f: f.read().split(b'\n')[lines // 2:lines // 2 + window]
+        whole = time.perf_counter() - start
+        return {
+            "file_mb": os.path.getsize(full_path) / 1e6,
+            "lines": lines,
+            "first_read_seconds": first,
+            "window_p50_ms": percentile(latencies, 50) * 1000,
+            "window_p99_ms": percentile(latencies, 99) * 1000,
+            "windows_per_sec": len(latencies) / sum(latencies),
+            "whole_file_read_seconds": whole,
+            "line_index": server.LINE_INDEXES.stats()
+        }
+    finally:
+        os.remove(full_path)
+
+def bench_write(args):
+    """/api/batch-write throughput against one /api/write per file, plus its rollback and directory-target behaviour."""
+    base = 'bench-write'
+    client = server.app.test_client()
+    files = [{"path": f"{base}/w{i // 50}/f{i}.txt", "content": f"file {i}\n" * 20} for i in range(args.batch)]
+    def check(ok, what):
+        if not ok: raise SystemExit(f"batch-write: {what}")
+    def listed():
+        with ROOT.lock: return sorted(ROOT.index.paths_under(base))
+    def read(rel_path):
+        with open(os.path.join(ROOT.dir, rel_path)) as f: return f.read()
+    try:
+        start = time.perf_counter()
+        for f in files: client.post('/api/write', json=f)
+        single = time.perf_counter() - start
+        start = time.perf_counter()
+        reply = client.post('/api/batch-write', json={"files": [dict(f, content=f["content"] + "v2") for f in files]}).json
+        batch = time.perf_counter() - start
+        check(reply.get("written") == len(files), f"unexpected reply {reply}")
+        check(listed() == sorted(f["path"] for f in files), "index does not match the written files")
+
+        # A missing move source after a good write and a write into new directories: everything is undone
+        before = listed()
+        reply = client.post('/api/batch-write', json={
+            "files": [{"path": files[0]["path"], "content": "changed"}, {"path": f"{base}/brand/new/x.txt", "content": "x"}],
+            "moves": [{"source": f"{base}/missing.txt", "destination": f"{base}/m.txt"}]}).json
+        check(reply.get("rolled_back") is True, f"failed batch was not rolled back: {reply}")
+        check(read(files[0]["path"]) == files[0]["content"] + "v2", "rollback did not restore the overwritten file")
+        check(not os.path.exists(os.path.join(ROOT.dir, base, 'brand')), "rollback left created directories behind")
+        check(listed() == before, "index changed by a rolled-back batch")
+
+        # A directory is never replaced by a file
+        reply = client.post('/api/batch-write', json={"files": [{"path": f"{base}/w0", "content": "x"}]}).json
+        check(reply.get("rolled_back") is True, f"writing over a directory was not rejected: {reply}")
+        check(os.path.isfile(os.path.join(ROOT.dir, files[0]["path"])) and listed() == before, "writing over a directory lost files")
+
+        # Moving onto a directory moves into it, like /api/move
+        src = files[0]["path"]
+        os.makedirs(os.path.join(ROOT.dir, base, 'into'))
+        reply = client.post('/api/batch-write', json={"moves": [{"source": src, "destination": f"{base}/into"}]}).json
+        moved = f"{base}/into/{os.path.basename(src)}"
+        check(reply.get("status") == "ok" and os.path.isfile(os.path.join(ROOT.dir, moved)), f"move onto a directory failed: {reply}")
+        check(listed() == sorted(set(before) - {src} | {moved}), "index does not match after moving into a directory")
+        return {
+            "files": len(files),
+            "single_writes": {"seconds": single, "files_per_sec": len(files) / single},
+            "batch_write": {"seconds": batch, "files_per_sec": len(files) / batch, "speedup": single / batch}
+        }
+    finally:
+        client.post('/api/delete', json={"path": base})
+
+def unified_diff(a, b, context):
+    """difflib's unified diff plus the "\\ No newline at end of file" markers it leaves out."""
+    lines = difflib.unified_diff(a.splitlines(True), b.splitlines(True), 'a', 'b', n=context)
+    return ''.join(line if line.endswith('\n') else line + '\n\\ No newline at end of file\n' for line in lines)
+
+def random_edit(rng, text):
+    lines = text.splitlines(True)
+    for _ in range(rng.randint(1, 6)):
+        i = rng.randint(0, len(lines))
+        op = rng.random()
+        if op < 0.4: lines.insert(i, code_line(rng) + '\n')
+        elif op < 0.7 and i < len(lines): del lines[i]
+        elif i < len(lines): lines[i] = code_line(rng) + '\n'
+    text = ''.join(lines)
+    if rng.random() < 0.3: text = text.rstrip('\n')
+    return text
+
+def bench_patch(args):
+    """/api/patch against a full /api/write for a one-line edit, after checking both patch formats round-trip."""
+    rng = random.Random(args.seed)
+    for i in range(200):
+        a = '\n'.join(code_line(rng) for _ in range(rng.randint(0, 40))) + rng.choice(('', '\n'))
+        b = random_edit(rng, a)
+        if a == b: continue
+        if server.apply_unified_diff(a, unified_diff(a, b, rng.randint(0, 3))) != b:
+            raise SystemExit(f"apply_unified_diff does not reproduce difflib case {i}")
+        base, new = a.encode(), b.encode()
+        delta, pos = [], 0
+        while pos < len(new):
+            chunk = new[pos:pos + rng.randint(1, 64)]
+            start = base.find(chunk)
+            if start >= 0: delta.append({"copy": [start, len(chunk)]})
+            elif rng.random() < 0.5: delta.append({"data": chunk.decode()})
+            else: delta.append({"data_b64": base64.b64encode(chunk).decode()})
+            pos += len(chunk)
+        if server.apply_block_delta(base, delta) != new: raise SystemExit(f"apply_block_delta does not reproduce case {i}")
+
+    rel_path = 'bench-patch.txt'
+    full_path = os.path.join(ROOT.dir, rel_path)
+    client = server.app.test_client()
+    lines = [code_line(rng) + '\n' for _ in range(80000)]
+    text = ''.join(lines)
+    try:
+        client.post('/api/write', json={"path": rel_path, "content": text})
+        digest = server.hash_bytes(text.encode())
+        edited = lines[:]
+        edited[len(lines) // 2] = "changed\n"
+        diff = unified_diff(text, ''.join(edited), 3)
+
+        stale = client.post('/api/patch', json={"path": rel_path, "base_hash": "0" * 32, "patch": diff})
+        if stale.status_code != 409 or stale.json["hash"] != digest: raise SystemExit(f"stale base_hash gave {stale.status_code}, not 409")
+        bad = client.post('/api/patch', json={"path": rel_path, "base_hash": digest, "patch": unified_diff("other\n" + text[:200], "x\n", 3)})
+        if bad.status_code != 422: raise SystemExit(f"non-matching patch gave {bad.status_code}, not 422")
+        bad = client.post('/api/patch', json={"path": rel_path, "base_hash": digest, "delta": [{"copy": [0, len(text) + 1]}]})
+        if bad.status_code != 422: raise SystemExit(f"out-of-range delta gave {bad.status_code}, not 422")
+
+        start = time.perf_counter()
+        reply = client.post('/api/patch', json={"path": rel_path, "base_hash": digest, "patch": diff})
+        patch_seconds = time.perf_counter() - start
+        with open(full_path) as f:
+            if reply.status_code != 200 or f.read() != ''.join(edited): raise SystemExit("patch did not produce the edited file")
+        write_body = json.dumps({"path": rel_path, "content": ''.join(edited)})
+        start = time.perf_counter()
+        client.post('/api/write', data=write_body, content_type='application/json')
+        write_seconds = time.perf_counter() - start
+        return {
+            "file_bytes": len(text),
+            "patch": {"seconds": patch_seconds, "upload_bytes": len(json.dumps({"path": rel_path, "base_hash": digest, "patch": diff}))},
+            "write": {"seconds": write_seconds, "upload_bytes": len(write_body)}
+        }
+    finally:
+        client.post('/api/delete', json={"path": rel_path})
+
+BENCHMARKS = {
+    'index': bench_index,
+    'ignore': bench_ignore,
+    'io': bench_io,
+    'range': bench_range,
+    'write': bench_write,
+    'patch': bench_patch,
+    'memory': bench_memory,
+    'sse': bench_sse,
+    'search': bench_search,
+    'poll': bench_poll,
+    'server': bench_server,
+}
+
+# --- Results ---
+def run_metadata(args):
+    try: commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                 stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip() or None
+    except OSError: commit = None
+    return {"commit": commit, "time": time.strftime('%Y-%m-%dT%H:%M:%S'), "python": platform.python_version(),
+            "platform": platform.platform(), "cpus": os.cpu_count(), "args": vars(args)}
+
+def flatten(results, prefix=''):
+    """{"a": {"b": 1}} -> {"a.b": 1}, numbers only."""
+    out = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict): out.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool): out[name] = value
+    return out
+
+def better_direction(metric):
+    """+1 if higher is better, -1 if lower is better, 0 if it is just a count."""
+    leaf = metric.rsplit('.', 1)[-1]
+    if leaf.endswith('per_sec') or leaf.startswith('speedup') or leaf.endswith('_vs_threaded_rps'): return 1
+    if leaf in ('ratio', 'saved_per_file'): return 1
+    if leaf in ('seconds', 'ms') or leaf.endswith('_seconds') or leaf.endswith('_ms'): return -1
+    if 'bytes' in leaf or leaf.endswith('_fraction'): return -1
+    return 0
+
+def compare(baseline, current, threshold):
+    """Per-metric change against a baseline run; flags moves past `threshold` in the wrong direction."""
+    old, new = flatten(baseline.get("results", baseline)), flatten(current)
+    changes, regressions = {}, []
+    for metric in sorted(old.keys() & new.keys()):
+        direction = better_direction(metric)
+        if not direction or not old[metric]: continue
+        change = (new[metric] - old[metric]) / old[metric]
+        changes[metric] = {"baseline": old[metric], "current": new[metric], "change": change}
+        if change * direction < -threshold: regressions.append(metric)
+    return {"threshold": threshold, "metrics": changes, "regressions": regressions}
+
+def main():
+    parser = argparse.ArgumentParser(description="GenClaude sync server benchmarks")
+    parser.add_argument('bench', nargs='*', default=list(BENCHMARKS), help=f"benchmarks to run ({', '.join(BENCHMARKS)})")
+    parser.add_argument('--files', type=int, default=200000, help="synthetic files to generate")
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--fanout', type=int, default=6)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--clients', type=int, default=50, help="concurrent SSE clients")
+    parser.add_argument('--concurrency', type=int, default=16, help="request threads in the server benchmark")
+    parser.add_argument('--duration', type=float, default=5, help="seconds of load per server mode")
+    parser.add_argument('--churn', type=int, default=10000, help="files rewritten during the SSE run")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per measurement (best is kept)")
+    parser.add_argument('--poll-rate', type=int, default=20000, help="stat calls per second for the poll benchmark")
+    parser.add_argument('--reads', type=int, default=2000, help="files read in the io benchmark")
+    parser.add_argument('--batch', type=int, default=100, help="paths per /api/batch-read request")
+    parser.add_argument('--range-mb', type=int, default=400, help="size of the log file in the range benchmark")
+    parser.add_argument('--seed', type=int, default=1, help="synthetic tree seed")
+    parser.add_argument('--tree', help="reuse an existing tree instead of generating one")
+    parser.add_argument('--out', help="also write the results to this file")
+    parser.add_argument('--compare', metavar='BASELINE', help="compare against an earlier --out file; exits 1 on regressions")
+    parser.add_argument('--threshold', type=float, default=0.1, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    tmp = None
+    if args.tree:
+        root = args.tree
+    else:
+        tmp = tempfile.mkdtemp(prefix='genclaude-bench-')
+        print(f"Generating {args.files} files under {tmp}...", file=sys.stderr)
+        root = make_tree(tmp, args.files, args.depth, args.fanout, seed=args.seed)
+    use_root(root)
+    try:
+        results = {}
+        # Server logging goes to stderr so stdout stays valid JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            for name in args.bench:
+                print(f"Running {name}...")
+                results[name] = BENCHMARKS[name](args)
+    finally:
+        if tmp: shutil.rmtree(tmp, ignore_errors=True)
+
+    report = {"meta": run_metadata(args), "results": results}
+    if args.out:
+        with open(args.out, 'w') as f: json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f: baseline = json.load(f)
+        report["comparison"] = compare(baseline, results, args.threshold)
+        old_args = baseline.get("meta", {}).get("args", {})
+        mismatched = [k for k in ('files', 'depth', 'fanout', 'seed', 'tree') if k in old_args and old_args[k] != getattr(args, k)]
+        if mismatched: report["comparison"]["tree_mismatch"] = mismatched
+    print(json.dumps(report, indent=2))
+    if args.compare and report["comparison"]["regressions"]:
+        print(f"Regressions: {', '.join(report['comparison']['regressions'])}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
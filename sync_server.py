@@ -5,10 +5,28 @@ import json
 import logging
 import time
 import subprocess
+import signal
+import codecs
 import threading
 import queue
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import fnmatch
+import re
+try: import re._parser as sre_parse
+except ImportError: import sre_parse  # Python < 3.11
 import shutil
+import tempfile
+import stat
+import bisect
+import gzip
+import hashlib
+import base64
+from array import array
+from collections import deque, OrderedDict
+from itertools import islice
+from urllib.parse import parse_qs, unquote, unquote_to_bytes
 
 # -------------------------------------------------------
 #  GENCLAUDE SYNC SERVER V14.8 (With Interactive Selector)
@@ -35,8 +53,9 @@ try:
     from watchdog.events import FileSystemEventHandler
     HAS_WATCHDOG = True
 except ImportError:
-    print("\n[WARNING] 'watchdog' library not found. Live updates will not work.")
+    print("\n[WARNING] 'watchdog' library not found. Falling back to polling for live updates.")
     HAS_WATCHDOG = False
+    FileSystemEventHandler = object  # keeps ChangeHandler importable
 
 app = Flask(__name__)
 CORS(app)
@@ -62,10 +81,38 @@ C_BLUE = "\033[34m"
 
 # --- Config ---
 CONFIG = {
-    'ROOT_DIR': os.path.abspath(os.getcwd()),
+    'ROOTS': os.environ.get('GENCLAUDE_ROOTS', ''),  # "name=path,name=path" to serve several trees (default: the cwd)
     'MAX_FILE_SIZE': 5 * 1024 * 1024, # 5MB limit
-    'EXCLUDED_PATHS': set(),
-    'IGNORE_CONFIG_FILE': '.genclaude-ignore.json'
+    'IGNORE_CONFIG_FILE': '.genclaude-ignore.json',
+    'JOURNAL_SIZE': 50000,     # Max changes kept for /api/list?since=
+    'LIST_PAGE_SIZE': 5000,    # Default page size for paged listings
+    'SNAPSHOT_FILE': '.genclaude/index-snapshot.json.gz',
+    'SNAPSHOT_INTERVAL': 300,  # Seconds between periodic snapshot saves
+    'EVENT_REPLAY': 10000,     # Events kept for Last-Event-ID replay
+    'EVENT_BUFFER': 5000,      # Undelivered events per SSE client before it must resync
+    'EVENT_DEBOUNCE': 0.1,     # Seconds raw watchdog events are coalesced for
+    'EVENT_BATCH_MAX': 1000,   # Changes per batched SSE message
+    'CACHE_BYTES': 64 * 1024 * 1024,  # Content cache budget for /api/read and /api/batch-read
+    'READ_WORKERS': 8,         # Thread pool shared by batch reads
+    'RANGE_MAX_BYTES': 4 * 1024 * 1024,  # Most bytes one /api/read-range reply carries
+    'LINE_INDEX_BLOCK': 64 * 1024,  # Bytes per line-index block (bounds the scan per line lookup)
+    'LINE_INDEX_FILES': 32,    # Files whose line index is kept for /api/read-range
+    'SEARCH_INDEX': os.environ.get('GENCLAUDE_SEARCH_INDEX', '1') != '0',  # Trigram index for /api/search
+    'SEARCH_MAX_FILE_BYTES': 1024 * 1024,  # Larger files are only found by full scans
+    'EXEC_TIMEOUT': 30,        # Default seconds before a command is killed
+    'EXEC_MAX_TIMEOUT': 3600,  # Upper bound a client may ask for
+    'EXEC_MAX_JOBS': 4,        # Commands running at once
+    'EXEC_MAX_QUEUED': 32,     # Commands waiting for a slot before submits are refused
+    'EXEC_KEEP_JOBS': 100,     # Finished jobs kept for status/output queries
+    'EXEC_OUTPUT_BYTES': 1024 * 1024,  # Output retained per job (oldest chunks dropped first)
+    'SERVER_MODE': os.environ.get('GENCLAUDE_SERVER', 'threaded'),  # 'threaded' (Werkzeug) or 'asyncio'
+    'HTTP_WORKERS': 32,        # Threads running Flask routes in asyncio mode
+    'HTTP_IDLE_TIMEOUT': 60,   # Seconds an asyncio-mode connection may wait between reads before it is closed
+    'HTTP_MAX_BODY': 256 * 1024 * 1024,  # Largest request body accepted in asyncio mode (413 above)
+    'POLL_MODE': os.environ.get('GENCLAUDE_POLL', 'auto'),  # 'auto' (only without watchdog), 'on' or 'off'
+    'POLL_STAT_RATE': int(os.environ.get('GENCLAUDE_POLL_RATE', 2000)),  # Stat calls per second the poller may spend
+    'POLL_INTERVAL': 0.5,      # Seconds between poller ticks
+    'INDEX_WORKERS': int(os.environ.get('GENCLAUDE_INDEX_WORKERS', 0)) or min(16, (os.cpu_count() or 2) * 2)
 }
 
 # --- DEFAULT IGNORE LIST ---
@@ -88,13 +135,286 @@ BINARY_EXTENSIONS = {
     '.log', '.map'
 }
 
-# Active ignore list (will be customized)
-IGNORE_DIRS = set()
-CUSTOM_IGNORE_PATTERNS = set()
+# --- Metrics ---
+class TimedLock:
+    """
+    threading.Lock that adds up how long acquirers had to wait, for
+    /api/metrics. The uncontended path skips the timing, and the counters
+    are only touched while the lock is held.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_seconds = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self._lock.acquire(False):
+            self.acquisitions += 1
+            return True
+        if not blocking: return False
+        start = time.perf_counter()
+        if not self._lock.acquire(True, timeout): return False
+        self.acquisitions += 1
+        self.contended += 1
+        self.wait_seconds += time.perf_counter() - start
+        return True
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Metrics:
+    """Per-route request counters and latency histograms, plus a few one-off timings."""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.requests = {}   # (route, method, status) -> count
+        self.latency = {}    # (route, method) -> [per-bucket counts..., +Inf count, sum]
+        self.bytes = {}      # (route, method) -> response bytes
+        self.timings = {}    # (name, root) -> seconds of the last run
+        self.roots = {}      # root -> [requests, seconds, response bytes]
+
+    def observe(self, route, method, status, seconds, nbytes, root=None):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            key = (route, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            hist = self.latency.get(key[:2])
+            if hist is None: hist = self.latency[key[:2]] = [0] * (len(self.buckets) + 1) + [0.0]
+            hist[i] += 1
+            hist[-1] += seconds
+            self.bytes[key[:2]] = self.bytes.get(key[:2], 0) + nbytes
+            if root is not None:
+                usage = self.roots.setdefault(root, [0, 0.0, 0])
+                usage[0] += 1
+                usage[1] += seconds
+                usage[2] += nbytes
+
+    def record_timing(self, name, seconds, root=None):
+        with self.lock: self.timings[(name, root)] = seconds
+
+    def root_usage(self, root):
+        """(requests, seconds, response bytes) served for one root."""
+        with self.lock: return tuple(self.roots.get(root, (0, 0.0, 0)))
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.requests), {k: list(v) for k, v in self.latency.items()}, dict(self.bytes), dict(self.timings), {k: list(v) for k, v in self.roots.items()}
+
+METRICS = Metrics(LATENCY_BUCKETS)
+
+class MeteredBody:
+    """Response iterable that counts bytes sent and records the request when the server closes it."""
+    def __init__(self, result, environ, response, start):
+        self.result, self.environ, self.response, self.start = result, environ, response, start
+        self.nbytes = 0
+        self.recorded = False
+
+    def __iter__(self):
+        for chunk in self.result:
+            self.nbytes += len(chunk)
+            yield chunk
+        self.record()
+
+    def record(self):
+        # SSE streams last as long as the client stays; they would only swamp the top bucket
+        if self.recorded or self.response.get('stream'): return
+        self.recorded = True
+        root = self.environ.get('genclaude.root')
+        METRICS.observe(self.environ.get('genclaude.route', 'unmatched'), self.environ['REQUEST_METHOD'],
+                        self.response.get('status', '500'), time.perf_counter() - self.start, self.nbytes, root.name if root else None)
+
+    def close(self):
+        try:
+            if hasattr(self.result, 'close'): self.result.close()
+        finally: self.record()
+
+def metrics_middleware(wsgi_app):
+    def metered(environ, start_response):
+        start, response = time.perf_counter(), {}
+        def capture(status, headers, exc_info=None):
+            response['status'] = status[:3]
+            response['stream'] = any(k.lower() == 'content-type' and v.startswith('text/event-stream') for k, v in headers)
+            return start_response(status, headers, exc_info)
+        return MeteredBody(wsgi_app(environ, capture), environ, response, start)
+    return metered
+
+app.wsgi_app = metrics_middleware(app.wsgi_app)
 
 # --- In-Memory File Index ---
-FILE_INDEX = {}
-INDEX_LOCK = threading.Lock()
+class FileEntry:
+    """One index entry as handed out by FileIndex; reads like the old {"size", "mtime"[, "hash"]} dict."""
+    __slots__ = ('size', 'mtime', 'hash')
+
+    def __init__(self, size, mtime, digest=None):
+        self.size, self.mtime, self.hash = size, mtime, digest
+
+    def __getitem__(self, key):
+        if key == 'size': return self.size
+        if key == 'mtime': return self.mtime
+        if key == 'hash' and self.hash is not None: return self.hash
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try: return self[key]
+        except KeyError: return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __repr__(self):
+        return f"FileEntry(size={self.size}, mtime={self.mtime}, hash={self.hash})"
+
+_DIGEST_BYTES = sys.getsizeof(bytes(16))
+
+class FileIndex:
+    """
+    rel_path -> FileEntry mapping for every indexed file, laid out for
+    million-file trees: each directory string is stored once with a
+    {name: slot} dict, sizes and mtimes live in array columns addressed
+    by slot, and content hashes are kept as raw 16-byte digests. Entries
+    are built on access, so compare them by value, not identity.
+    """
+    def __init__(self):
+        self.dirs = {}
+        self.sizes = array('q')
+        self.mtimes = array('d')
+        self.hashes = {}
+        self.free = []
+        self.count = 0
+        # Bytes of directory strings, name strings and name dicts, kept up to date by put/remove
+        self.name_bytes = 0
+
+    def _slot(self, rel_path):
+        rel_dir, _, name = rel_path.rpartition('/')
+        names = self.dirs.get(rel_dir)
+        return names.get(name) if names is not None else None
+
+    def put(self, rel_path, size, mtime, digest=None):
+        rel_dir, _, name = rel_path.rpartition('/')
+        names = self.dirs.get(rel_dir)
+        if names is None:
+            names = self.dirs[sys.intern(rel_dir)] = {}
+            self.name_bytes += sys.getsizeof(rel_dir) + sys.getsizeof(names)
+        slot = names.get(name)
+        if slot is None:
+            before = sys.getsizeof(names)
+            if self.free:
+                slot = self.free.pop()
+                self.sizes[slot], self.mtimes[slot] = size, mtime
+            else:
+                slot = len(self.sizes)
+                self.sizes.append(size)
+                self.mtimes.append(mtime)
+            names[name] = slot
+            self.name_bytes += sys.getsizeof(names) - before + sys.getsizeof(name)
+            self.count += 1
+        else:
+            self.sizes[slot], self.mtimes[slot] = size, mtime
+        if digest: self.hashes[slot] = bytes.fromhex(digest)
+        else: self.hashes.pop(slot, None)
+
+    def remove(self, rel_path):
+        rel_dir, _, name = rel_path.rpartition('/')
+        names = self.dirs.get(rel_dir)
+        if names is None: return False
+        before = sys.getsizeof(names)
+        slot = names.pop(name, None)
+        if slot is None: return False
+        self.name_bytes -= before - sys.getsizeof(names) + sys.getsizeof(name)
+        if not names:
+            del self.dirs[rel_dir]
+            self.name_bytes -= sys.getsizeof(rel_dir) + sys.getsizeof(names)
+        self.hashes.pop(slot, None)
+        self.free.append(slot)
+        self.count -= 1
+        return True
+
+    def stats(self, rel_path):
+        """(size, mtime) or None, without building an entry."""
+        slot = self._slot(rel_path)
+        return None if slot is None else (self.sizes[slot], self.mtimes[slot])
+
+    def _entry(self, slot):
+        digest = self.hashes.get(slot)
+        return FileEntry(self.sizes[slot], self.mtimes[slot], digest.hex() if digest else None)
+
+    def get(self, rel_path, default=None):
+        slot = self._slot(rel_path)
+        return default if slot is None else self._entry(slot)
+
+    def hash_for(self, rel_path, size, mtime):
+        """The stored hash if the entry is still at (size, mtime)."""
+        slot = self._slot(rel_path)
+        if slot is None or self.sizes[slot] != size or self.mtimes[slot] != mtime: return None
+        digest = self.hashes.get(slot)
+        return digest.hex() if digest else None
+
+    def set_hash(self, rel_path, size, mtime, digest):
+        slot = self._slot(rel_path)
+        if slot is not None and self.sizes[slot] == size and self.mtimes[slot] == mtime: self.hashes[slot] = bytes.fromhex(digest)
+
+    def paths_under(self, rel_dir):
+        """Every path inside rel_dir; '' means the whole index."""
+        rel_dir = rel_dir.rstrip('/')
+        prefix = rel_dir + '/'
+        return [join_rel(d, name) for d, names in self.dirs.items() if not rel_dir or d == rel_dir or d.startswith(prefix) for name in names]
+
+    def iter_stats(self):
+        """(rel_path, size, mtime) for every file."""
+        sizes, mtimes = self.sizes, self.mtimes
+        for d, names in self.dirs.items():
+            for name, slot in names.items(): yield (f"{d}/{name}" if d else name), sizes[slot], mtimes[slot]
+
+    def __getitem__(self, rel_path):
+        slot = self._slot(rel_path)
+        if slot is None: raise KeyError(rel_path)
+        return self._entry(slot)
+
+    def __setitem__(self, rel_path, entry):
+        self.put(rel_path, entry["size"], entry["mtime"], entry.get("hash"))
+
+    def __delitem__(self, rel_path):
+        if not self.remove(rel_path): raise KeyError(rel_path)
+
+    def __contains__(self, rel_path):
+        return self._slot(rel_path) is not None
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for d, names in self.dirs.items():
+            if d:
+                for name in names: yield f"{d}/{name}"
+            else: yield from names
+
+    keys = __iter__
+
+    def items(self):
+        for d, names in self.dirs.items():
+            for name, slot in names.items(): yield (f"{d}/{name}" if d else name), self._entry(slot)
+
+    def clear(self):
+        self.__init__()
+
+    def update(self, entries):
+        for rel_path, entry in entries.items(): self[rel_path] = entry
+
+    def memory_bytes(self):
+        """Approximate footprint: columns, stored hashes and the per-directory name dicts. Constant time."""
+        total = sys.getsizeof(self.sizes) + sys.getsizeof(self.mtimes) + sys.getsizeof(self.dirs) + self.name_bytes
+        return total + sys.getsizeof(self.hashes) + len(self.hashes) * _DIGEST_BYTES
 
 # --- UI Helpers ---
 def get_key():
@@ -149,13 +469,13 @@ def get_key():
 def clear_screen():
     os.system('cls' if os.name == 'nt' else 'clear')
 
-def save_ignore_config():
+def save_ignore_config(root):
     """Save custom ignore list to file"""
-    config_path = os.path.join(CONFIG['ROOT_DIR'], CONFIG['IGNORE_CONFIG_FILE'])
+    config_path = os.path.join(root.dir, CONFIG['IGNORE_CONFIG_FILE'])
     config_data = {
-        'ignore_dirs': list(IGNORE_DIRS),
-        'custom_patterns': list(CUSTOM_IGNORE_PATTERNS),
-        'excluded_paths': list(CONFIG['EXCLUDED_PATHS']),
+        'ignore_dirs': list(root.ignore_dirs),
+        'custom_patterns': list(root.custom_patterns),
+        'excluded_paths': list(root.excluded_paths),
         'timestamp': time.time()
     }
     try:
@@ -165,39 +485,45 @@ def save_ignore_config():
     except Exception as e:
         print(f"{C_RED}✖ Failed to save config: {e}{C_RESET}")
 
-def load_ignore_config():
+def load_ignore_config(root):
     """Load custom ignore list from file"""
-    config_path = os.path.join(CONFIG['ROOT_DIR'], CONFIG['IGNORE_CONFIG_FILE'])
+    config_path = os.path.join(root.dir, CONFIG['IGNORE_CONFIG_FILE'])
     if os.path.exists(config_path):
         try:
             with open(config_path, 'r') as f:
                 config_data = json.load(f)
-            IGNORE_DIRS.update(config_data.get('ignore_dirs', []))
-            CUSTOM_IGNORE_PATTERNS.update(config_data.get('custom_patterns', []))
-            CONFIG['EXCLUDED_PATHS'].update(config_data.get('excluded_paths', []))
+            root.ignore_dirs.update(config_data.get('ignore_dirs', []))
+            root.custom_patterns.update(config_data.get('custom_patterns', []))
+            root.excluded_paths.update(config_data.get('excluded_paths', []))
+            rebuild_ignore_matcher(root)
             return True
         except Exception as e:
             print(f"{C_YELLOW}⚠ Failed to load config: {e}{C_RESET}")
     return False
 
-def run_interactive_selector():
+def load_root_rules(root):
+    """Saved ignore config for a root, or the defaults. Returns True if a saved config was found."""
+    loaded = load_ignore_config(root)
+    if not loaded: root.ignore_dirs.update(DEFAULT_IGNORE_DIRS)
+    # Auto-add default patterns if not present
+    root.custom_patterns.update({'*~', '*.tmp'})
+    rebuild_ignore_matcher(root)
+    return loaded
+
+def run_interactive_selector(root):
     """Interactive file/folder selector with navigation"""
     # Load existing config or use defaults
-    if load_ignore_config():
+    if load_root_rules(root):
         print(f"{C_GREEN}✔ Loaded existing ignore configuration{C_RESET}")
         time.sleep(1)
-    else:
-        IGNORE_DIRS.update(DEFAULT_IGNORE_DIRS)
-
-    # Auto-add default patterns if not present
-    if '*~' not in CUSTOM_IGNORE_PATTERNS: CUSTOM_IGNORE_PATTERNS.add('*~')
-    if '*.tmp' not in CUSTOM_IGNORE_PATTERNS: CUSTOM_IGNORE_PATTERNS.add('*.tmp')
+    excluded_paths = root.excluded_paths
+    ignore_dirs = root.ignore_dirs
 
     current_rel_path = "."
     cursor_idx = 0
 
     while True:
-        full_current_path = os.path.abspath(os.path.join(CONFIG['ROOT_DIR'], current_rel_path))
+        full_current_path = os.path.abspath(os.path.join(root.dir, current_rel_path))
 
         items = []
         try:
@@ -225,7 +551,7 @@ def run_interactive_selector():
         for item in items:
             p = os.path.normpath(os.path.join(current_rel_path, item)).replace("\\", "/")
             if p.startswith("./"): p = p[2:]
-            if p in CONFIG['EXCLUDED_PATHS'] or item in IGNORE_DIRS or item.lower() in IGNORE_DIRS:
+            if p in excluded_paths or item in ignore_dirs or item.lower() in ignore_dirs:
                 excluded_count += 1
 
         print(f"\n  📊 Stats: {len(items) - excluded_count} included, {excluded_count} excluded")
@@ -246,7 +572,7 @@ def run_interactive_selector():
             item_rel_path = os.path.normpath(os.path.join(current_rel_path, item)).replace("\\", "/")
             if item_rel_path.startswith("./"): item_rel_path = item_rel_path[2:]
 
-            is_excluded = item_rel_path in CONFIG['EXCLUDED_PATHS'] or item in IGNORE_DIRS or item.lower() in IGNORE_DIRS
+            is_excluded = item_rel_path in excluded_paths or item in ignore_dirs or item.lower() in ignore_dirs
             full_item_path = os.path.join(full_current_path, item)
             is_dir = os.path.isdir(full_item_path)
 
@@ -268,14 +594,15 @@ def run_interactive_selector():
              print(f"  {C_GREY}... {len(items) - end_idx} more items ...{C_RESET}")
 
         print(f"{C_GREY}" + "-"*70 + f"{C_RESET}")
-        print(f"  Total Exclusions: {len(CONFIG['EXCLUDED_PATHS'])}")
+        print(f"  Total Exclusions: {len(excluded_paths)}")
         print(f"{C_CYAN}="*70 + f"{C_RESET}")
 
         key = get_key()
 
         if key == 'f':
             # Save and exit
-            save_ignore_config()
+            save_ignore_config(root)
+            rebuild_ignore_matcher(root)
             break
         elif key == 'esc':
             print("\n  ❌ Cancelled by user")
@@ -290,18 +617,20 @@ def run_interactive_selector():
                 item_rel_path = os.path.normpath(os.path.join(current_rel_path, item)).replace("\\", "/")
                 if item_rel_path.startswith("./"): item_rel_path = item_rel_path[2:]
 
-                if item_rel_path in CONFIG['EXCLUDED_PATHS']:
-                    CONFIG['EXCLUDED_PATHS'].remove(item_rel_path)
+                if item_rel_path in excluded_paths:
+                    excluded_paths.remove(item_rel_path)
                 else:
-                    CONFIG['EXCLUDED_PATHS'].add(item_rel_path)
+                    excluded_paths.add(item_rel_path)
+                rebuild_ignore_matcher(root)
         elif key == 'i':
             for item in items:
                 item_rel_path = os.path.normpath(os.path.join(current_rel_path, item)).replace("\\", "/")
                 if item_rel_path.startswith("./"): item_rel_path = item_rel_path[2:]
-                if item_rel_path in CONFIG['EXCLUDED_PATHS']:
-                    CONFIG['EXCLUDED_PATHS'].remove(item_rel_path)
+                if item_rel_path in excluded_paths:
+                    excluded_paths.remove(item_rel_path)
                 else:
-                    CONFIG['EXCLUDED_PATHS'].add(item_rel_path)
+                    excluded_paths.add(item_rel_path)
+            rebuild_ignore_matcher(root)
         elif key == 'right' or key == 'enter' or key == 'd':
             if items:
                 item = items[cursor_idx]
@@ -315,142 +644,2095 @@ def run_interactive_selector():
                 cursor_idx = 0
 
 # --- Core Functions ---
-def get_relative_path(path):
-    try: return os.path.relpath(path, CONFIG['ROOT_DIR']).replace(os.sep, '/')
+def get_relative_path(root, path):
+    try: return os.path.relpath(path, root.dir).replace(os.sep, '/')
     except: return path
 
-def is_path_excluded(rel_path):
-    parts = rel_path.replace("\\", "/").split("/")
-    for pattern in CUSTOM_IGNORE_PATTERNS:
-        if pattern in rel_path or fnmatch.fnmatch(rel_path, pattern): return True
-        if fnmatch.fnmatch(os.path.basename(rel_path), pattern): return True
-
-    accum = ""
-    for part in parts:
-        accum = f"{accum}/{part}" if accum else part
-        if accum in CONFIG['EXCLUDED_PATHS']: return True
-        # Case insensitive check for ignore dirs (like node_modules vs Node_Modules)
-        if part in IGNORE_DIRS or part.lower() in IGNORE_DIRS: return True
-    return False
-
-def is_valid_file(path, rel_path):
+class IgnoreMatcher:
+    """
+    Compiled form of the ignore rules. Custom patterns become two regexes
+    (substring and glob), and the per-component checks against the
+    excluded paths and ignore dirs are memoized per directory, so a file
+    costs one regex pass plus lookups on its own name.
+    """
+    MAX_MEMO = 200000
+
+    def __init__(self, ignore_dirs, patterns, excluded_paths):
+        self.ignore_dirs = frozenset(ignore_dirs)
+        self.excluded_paths = frozenset(excluded_paths)
+        self.dir_memo = {}
+        if patterns:
+            patterns = sorted(patterns)
+            self.substr_re = re.compile('|'.join(re.escape(p) for p in patterns))
+            self.glob_re = re.compile('|'.join(f"(?:{fnmatch.translate(os.path.normcase(p))})" for p in patterns))
+        else:
+            self.substr_re = self.glob_re = None
+
+    def _name_excluded(self, norm, name):
+        return norm.lstrip('/') in self.excluded_paths or name in self.ignore_dirs or name.lower() in self.ignore_dirs
+
+    def _dir_excluded(self, norm_dir):
+        hit = self.dir_memo.get(norm_dir)
+        if hit is None:
+            parent, sep, name = norm_dir.rpartition('/')
+            hit = bool(sep and self._dir_excluded(parent)) or self._name_excluded(norm_dir, name)
+            if len(self.dir_memo) >= self.MAX_MEMO: self.dir_memo.clear()
+            self.dir_memo[norm_dir] = hit
+        return hit
+
+    def is_excluded(self, rel_path):
+        if self.substr_re is not None:
+            if self.substr_re.search(rel_path): return True
+            if self.glob_re.match(os.path.normcase(rel_path)): return True
+            if self.glob_re.match(os.path.normcase(os.path.basename(rel_path))): return True
+        norm = rel_path.replace("\\", "/")
+        norm_dir, sep, name = norm.rpartition('/')
+        if sep and self._dir_excluded(norm_dir): return True
+        return self._name_excluded(norm, name)
+
+def rebuild_ignore_matcher(root):
+    """Recompiles a root's ignore rules. Call after changing its ignore_dirs, custom_patterns or excluded_paths."""
+    root.matcher = IgnoreMatcher(root.ignore_dirs, root.custom_patterns, root.excluded_paths)
+
+def is_path_excluded(root, rel_path):
+    return root.matcher.is_excluded(rel_path)
+
+def is_valid_file(root, path, rel_path):
     if path.endswith('~'): return False
-    if is_path_excluded(rel_path): return False
     ext = os.path.splitext(path)[1].lower()
     if ext in BINARY_EXTENSIONS: return False
     if os.path.basename(path).startswith('.'): return False
+    if is_path_excluded(root, rel_path): return False
+    return True
+
+# --- Merkle Tree ---
+class MerkleTree:
+    """
+    Directory hashes over a root's FileIndex, so clients can compare a
+    mirror by descending only into subtrees whose hash differs. Mutations
+    mark the directory and its ancestors dirty; hashes are recomputed on
+    request. Guarded by the root's lock, like the index it mirrors.
+
+    Hashes are blake2b-128, hex encoded, reproducible client side:
+      file = H("<name>\0<size>\0<int(mtime * 1000)>")
+      dir  = H(lines sorted by name, "d <name> <dir hash>\n" or "f <name> <file hash>\n")
+    Only directories holding indexed files exist; the root is "".
+    """
+    def __init__(self, index):
+        self.index = index
+        self.files = {}
+        self.dirs = {"": set()}
+        self.hashes = {}
+        self.dirty = set()
+        self.stale = True
+
+    @staticmethod
+    def leaf_hash(name, size, mtime):
+        return hashlib.blake2b(f"{name}\0{size}\0{int(mtime * 1000)}".encode('utf-8'), digest_size=16).hexdigest()
+
+    def _mark(self, rel_dir):
+        while rel_dir not in self.dirty:
+            self.dirty.add(rel_dir)
+            if not rel_dir: break
+            rel_dir = rel_dir.rpartition('/')[0]
+
+    def put(self, rel_path, size, mtime):
+        if self.stale: return
+        rel_dir, _, name = rel_path.rpartition('/')
+        files = self.files.get(rel_dir)
+        if files is None:
+            files = self.files[rel_dir] = {}
+            child = rel_dir
+            while child:
+                parent, _, child_name = child.rpartition('/')
+                siblings = self.dirs.setdefault(parent, set())
+                if child_name in siblings: break
+                siblings.add(child_name)
+                self.dirs.setdefault(child, set())
+                child = parent
+        files[name] = self.leaf_hash(name, size, mtime)
+        self._mark(rel_dir)
+
+    def remove(self, rel_path):
+        if self.stale: return
+        rel_dir, _, name = rel_path.rpartition('/')
+        files = self.files.get(rel_dir)
+        if not files or files.pop(name, None) is None: return
+        self._mark(rel_dir)
+        # Prune directories that no longer hold anything
+        while rel_dir and not self.files.get(rel_dir) and not self.dirs.get(rel_dir):
+            self.files.pop(rel_dir, None)
+            self.dirs.pop(rel_dir, None)
+            self.hashes.pop(rel_dir, None)
+            self.dirty.discard(rel_dir)
+            parent, _, child_name = rel_dir.rpartition('/')
+            self.dirs[parent].discard(child_name)
+            rel_dir = parent
+
+    def invalidate(self):
+        """Drops everything; rebuilt from the index on the next lookup."""
+        self.files, self.dirs, self.hashes, self.dirty = {}, {"": set()}, {}, set()
+        self.stale = True
+
+    def _rebuild(self):
+        self.stale = False
+        for rel_path, size, mtime in self.index.iter_stats(): self.put(rel_path, size, mtime)
+        self._mark("")
+
+    def dir_hash(self, rel_dir):
+        if rel_dir in self.dirty or rel_dir not in self.hashes:
+            lines = [(name, f"d {name} {self.dir_hash(join_rel(rel_dir, name))}\n") for name in self.dirs.get(rel_dir, ())]
+            lines += [(name, f"f {name} {h}\n") for name, h in self.files.get(rel_dir, {}).items()]
+            lines.sort()
+            self.hashes[rel_dir] = hashlib.blake2b(''.join(line for _, line in lines).encode('utf-8'), digest_size=16).hexdigest()
+            self.dirty.discard(rel_dir)
+        return self.hashes[rel_dir]
+
+    def node(self, rel_dir):
+        """The hash of a directory and of its direct children, or None if it holds no indexed files."""
+        if self.stale: self._rebuild()
+        if rel_dir not in self.dirs: return None
+        return {
+            "path": rel_dir,
+            "hash": self.dir_hash(rel_dir),
+            "dirs": {name: self.dir_hash(join_rel(rel_dir, name)) for name in sorted(self.dirs[rel_dir])},
+            "files": dict(sorted(self.files.get(rel_dir, {}).items()))
+        }
+
+# --- Search Index ---
+def trigrams(text):
+    # Matching is per line, so repeated lines add nothing
+    text = '\n'.join(set(text.lower().split('\n')))
+    return set(map(''.join, set(zip(text, text[1:], text[2:]))))
+
+def required_literals(pattern):
+    """Literal runs every match of a regex must contain (top-level sequence only; alternations give none)."""
+    try: parsed = sre_parse.parse(pattern)
+    except re.error: return []
+    runs, run = [], []
+    for op, arg in parsed:
+        if op == sre_parse.LITERAL:
+            run.append(chr(arg))
+        else:
+            if run: runs.append(''.join(run))
+            run = []
+    if run: runs.append(''.join(run))
+    return runs
+
+class TrigramIndex:
+    """
+    Lowercased trigram -> array of file ids, used to narrow /api/search to
+    files that can possibly match before they are scanned line by line.
+    A background worker re-reads files as the index mutation hooks report
+    them. Updated or removed files just lose their live id; the postings
+    are compacted by a rebuild once dead ids outnumber live ones. Indexed
+    files it cannot take (too large, binary) are kept in `unindexed` and
+    are always candidates.
+    """
+    def __init__(self, root, enabled, max_file_bytes):
+        self.root = root
+        self.enabled = enabled
+        self.max_file_bytes = max_file_bytes
+        self.lock = threading.Lock()
+        self.postings = {}
+        self.ids = {}
+        self.paths = {}
+        self.unindexed = set()
+        self.next_id = 0
+        self.dead = 0
+        self.ready = False
+        self.pending = set()
+        self.processing = set()
+        self.rebuild_requested = False
+        self.wake = threading.Event()
+
+    def notify(self, rel_path):
+        if not self.enabled: return
+        with self.lock: self.pending.add(rel_path)
+        self.wake.set()
+
+    def request_rebuild(self):
+        if not self.enabled: return
+        with self.lock:
+            self.rebuild_requested = True
+            self.ready = False
+        self.wake.set()
+
+    def _read_grams(self, rel_path):
+        try:
+            with open(os.path.join(self.root.dir, rel_path), 'rb') as f: raw = f.read(self.max_file_bytes + 1)
+        except OSError: return None
+        if len(raw) > self.max_file_bytes or b'\0' in raw: return None
+        return trigrams(raw.decode('utf-8', errors='replace'))
+
+    def _add(self, postings, file_id, grams):
+        for gram in grams:
+            ids = postings.get(gram)
+            if ids is None: ids = postings[gram] = array('I')
+            ids.append(file_id)
+
+    def _update(self, rel_path):
+        with self.root.lock: indexed = rel_path in self.root.index
+        grams = self._read_grams(rel_path) if indexed else None
+        with self.lock:
+            old = self.ids.pop(rel_path, None)
+            if old is not None:
+                del self.paths[old]
+                self.dead += 1
+            if grams is None:
+                if indexed: self.unindexed.add(rel_path)
+                else: self.unindexed.discard(rel_path)
+                return
+            self.unindexed.discard(rel_path)
+            file_id = self.next_id
+            self.next_id += 1
+            self.ids[rel_path] = file_id
+            self.paths[file_id] = rel_path
+            self._add(self.postings, file_id, grams)
+            if self.dead > 1000 and self.dead > len(self.paths): self.rebuild_requested = True
+
+    def _rebuild(self):
+        start = time.time()
+        with self.root.lock: paths = list(self.root.index)
+        postings, ids, unindexed = {}, {}, set()
+        for file_id, rel_path in enumerate(paths):
+            grams = self._read_grams(rel_path)
+            if grams is None:
+                unindexed.add(rel_path)
+                continue
+            ids[rel_path] = file_id
+            self._add(postings, file_id, grams)
+        with self.lock:
+            self.postings, self.ids, self.unindexed = postings, ids, unindexed
+            self.paths = {file_id: rel_path for rel_path, file_id in ids.items()}
+            self.next_id, self.dead = len(paths), 0
+            self.ready = True
+        METRICS.record_timing('search', time.time() - start, self.root.name)
+        print(f"{C_GREEN}[Search] {self.root.name}: indexed {len(ids)} files ({len(postings)} trigrams) in {time.time() - start:.2f}s.{C_RESET}")
+
+    def run(self):
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            try:
+                with self.lock:
+                    rebuild, self.rebuild_requested = self.rebuild_requested, False
+                if rebuild: self._rebuild()
+                with self.lock:
+                    self.processing, self.pending = self.pending, set()
+                for rel_path in self.processing: self._update(rel_path)
+                with self.lock:
+                    self.processing = set()
+                    if self.rebuild_requested: self.wake.set()
+            except Exception as e: print(f"{C_RED}[Search] {self.root.name}: index update failed: {e}{C_RESET}")
+
+    def start(self):
+        if self.enabled: threading.Thread(target=self.run, daemon=True).start()
+
+    def candidates(self, literals):
+        """
+        Paths that may contain all the literals, or None if the index can't
+        narrow it down (not built yet, or no literal of 3+ chars).
+        """
+        grams = set()
+        for literal in literals:
+            if len(literal) >= 3: grams |= trigrams(literal)
+        with self.lock:
+            if not self.enabled or not self.ready or not grams: return None
+            lists = sorted((self.postings.get(g, ()) for g in grams), key=len)
+            ids = set(lists[0])
+            for other in lists[1:]:
+                if not ids: break
+                ids.intersection_update(other)
+            found = {self.paths[i] for i in ids if i in self.paths}
+            # Files still queued for re-indexing may match already; skipped files always might
+            return found | self.unindexed | self.pending | self.processing
+
+    def stats(self):
+        with self.lock:
+            postings = sum(len(ids) for ids in self.postings.values())
+            memory = sys.getsizeof(self.postings) + sum(sys.getsizeof(g) + sys.getsizeof(ids) for g, ids in self.postings.items())
+            memory += sys.getsizeof(self.ids) + sys.getsizeof(self.paths) + 100 * len(self.ids)
+            return {"enabled": self.enabled, "ready": self.ready, "files": len(self.paths), "trigrams": len(self.postings),
+                    "postings": postings, "dead_ids": self.dead, "unindexed": len(self.unindexed), "pending": len(self.pending) + len(self.processing), "memory_bytes": memory}
+
+# --- Index Mutation (caller must hold root.lock) ---
+# Every index mutation gets a monotonic sequence number in the root's change
+# journal. Clients poll /api/list?since=<cursor> and receive only what
+# changed after it. The epoch changes whenever the index is rebuilt, which
+# expires old cursors.
+def index_put(root, rel_path, size, mtime):
+    root.index.put(rel_path, size, mtime)
+    root.merkle.put(rel_path, size, mtime)
+    root.search.notify(rel_path)
+    root.seq += 1
+    root.journal.append((root.seq, rel_path, size, mtime))
+
+def index_remove(root, rel_path):
+    if not root.index.remove(rel_path): return False
+    root.merkle.remove(rel_path)
+    root.search.notify(rel_path)
+    root.seq += 1
+    root.journal.append((root.seq, rel_path, None, None))
     return True
 
+def index_replace(root, new_index):
+    """Swaps in a freshly built index. Starts a new journal epoch."""
+    root.index.clear()
+    root.index.update(new_index)
+    root.merkle.invalidate()
+    root.search.request_rebuild()
+    root.seq = 0
+    root.epoch = format(int(time.time() * 1000), 'x')
+    root.journal.clear()
+
+def make_cursor(root):
+    return f"{root.epoch}:{root.seq}"
+
+def journal_since(root, cursor):
+    """Returns the latest change per path after cursor, or None if the cursor expired."""
+    try:
+        epoch, seq = cursor.split(':')
+        seq = int(seq)
+    except (ValueError, AttributeError): return None
+    if epoch != root.epoch or seq > root.seq: return None
+    oldest = root.journal[0][0] if root.journal else root.seq + 1
+    if seq < oldest - 1: return None
+
+    latest = {}
+    for rec_seq, path, size, mtime in reversed(root.journal):
+        if rec_seq <= seq: break
+        if path not in latest: latest[path] = (size, mtime)
+    changes = []
+    for path, (size, mtime) in latest.items():
+        if size is None: changes.append({"path": path, "op": "delete"})
+        else: changes.append({"path": path, "op": "upsert", "size": size, "mtime": mtime})
+    changes.reverse()
+    return changes
+
+# --- Event Hub ---
+class Subscriber:
+    """One SSE client. Holds at most `size` undelivered events; `root` limits it to one root's events."""
+    def __init__(self, size, root=None):
+        self.size = size
+        self.root = root
+        self.buffer = deque()
+        self.cond = threading.Condition()
+        self.resync_id = None
+        self.waker = None
+
+    def push(self, event):
+        with self.cond:
+            if self.resync_id is not None or len(self.buffer) >= self.size:
+                # Too far behind: drop the backlog, the client must resync
+                self.buffer.clear()
+                self.resync_id = event[0]
+            else:
+                self.buffer.append(event)
+            self.cond.notify()
+        if self.waker: self.waker()
+
+    def pull(self, timeout):
+        """Waits for events. Returns (events, resync_id)."""
+        with self.cond:
+            if not self.buffer and self.resync_id is None: self.cond.wait(timeout)
+            events, resync_id = list(self.buffer), self.resync_id
+            self.buffer.clear()
+            self.resync_id = None
+        return events, resync_id
+
+class EventHub:
+    """
+    Publish/subscribe fan-out for /api/events, shared by all roots. Every
+    client sees every event of its root, plus events published without a
+    root. Events get ids of the form <epoch>-<n> and are kept in a bounded
+    replay log so a reconnecting client can resume from Last-Event-ID.
+    """
+    def __init__(self, replay_size, buffer_size):
+        self.lock = threading.Lock()
+        self.epoch = format(int(time.time() * 1000), 'x')
+        self.last_seq = 0
+        self.replay = deque(maxlen=replay_size)
+        self.buffer_size = buffer_size
+        self.subscribers = set()
+
+    def make_id(self, seq):
+        return f"{self.epoch}-{seq}"
+
+    def publish(self, data, root=None):
+        if root is not None: data["root"] = root
+        with self.lock:
+            self.last_seq += 1
+            event = (self.make_id(self.last_seq), json.dumps(data))
+            self.replay.append((self.last_seq, event, root))
+            for sub in self.subscribers:
+                if sub.root is None or root is None or sub.root == root: sub.push(event)
+
+    def subscribe(self, last_event_id=None, root=None):
+        sub = Subscriber(self.buffer_size, root)
+        with self.lock:
+            if last_event_id:
+                epoch, _, seq = last_event_id.partition('-')
+                try: seq = int(seq)
+                except ValueError: seq = -1
+                oldest = self.replay[0][0] if self.replay else self.last_seq + 1
+                if epoch != self.epoch or seq < oldest - 1 or seq > self.last_seq:
+                    sub.resync_id = self.make_id(self.last_seq)
+                else:
+                    for event_seq, event, event_root in self.replay:
+                        if event_seq > seq and (root is None or event_root in (None, root)): sub.push(event)
+            self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.lock: self.subscribers.discard(sub)
+
+EVENT_HUB = EventHub(CONFIG['EVENT_REPLAY'], CONFIG['EVENT_BUFFER'])
+
+# --- Content Cache ---
+class ContentCache:
+    """
+    LRU cache of decoded file contents with a total byte budget. Entries
+    remember the (size, mtime) they were read at and are only served while
+    the file on disk still matches; the event pipeline and write routes
+    also drop entries as soon as they know a file changed. Keyed by full
+    path, so all roots share one budget.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get(self, full_path, size, mtime):
+        with self.lock:
+            entry = self.entries.get(full_path)
+            if entry is None or entry[0] != size or entry[1] != mtime:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(full_path)
+            self.hits += 1
+            return entry[2], entry[3]
+
+    def put(self, full_path, size, mtime, content, digest):
+        if size > self.max_bytes // 4: return
+        with self.lock:
+            old = self.entries.pop(full_path, None)
+            if old is not None: self.bytes -= old[0]
+            self.entries[full_path] = (size, mtime, content, digest)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted[0]
+                self.evictions += 1
+
+    def invalidate(self, full_path):
+        with self.lock:
+            old = self.entries.pop(full_path, None)
+            if old is not None:
+                self.bytes -= old[0]
+                self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.bytes, "max_bytes": self.max_bytes, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions, "invalidations": self.invalidations}
+
+CONTENT_CACHE = ContentCache(CONFIG['CACHE_BYTES'])
+
+class FileTooLarge(Exception):
+    pass
+
+def hash_bytes(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def hash_file(full_path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(full_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''): h.update(chunk)
+    return h.hexdigest()
+
+def indexed_hash(root, rel_path, size, mtime):
+    """The hash cached on the index entry, if it was computed at this (size, mtime)."""
+    with root.lock: return root.index.hash_for(rel_path, size, mtime)
+
+def remember_hash(root, rel_path, size, mtime, digest):
+    with root.lock: root.index.set_hash(rel_path, size, mtime, digest)
+
+def content_hash(root, rel_path):
+    """Hash of a file's bytes, computed lazily and cached against (size, mtime)."""
+    full_path = os.path.join(root.dir, rel_path)
+    st = os.stat(full_path)
+    digest = indexed_hash(root, rel_path, st.st_size, st.st_mtime)
+    if digest is None:
+        digest = hash_file(full_path)
+        remember_hash(root, rel_path, st.st_size, st.st_mtime, digest)
+    return digest
+
+def read_text(root, rel_path, known_hash=None):
+    """
+    Reads a file as text through CONTENT_CACHE. Returns (content, hash);
+    content is None when the file still has known_hash, and the read is
+    skipped entirely if that hash is already known for this (size, mtime).
+    Raises OSError or FileTooLarge.
+    """
+    full_path = os.path.join(root.dir, rel_path)
+    st = os.stat(full_path)
+    if st.st_size > CONFIG['MAX_FILE_SIZE']: raise FileTooLarge("File too large to read, use /api/read-range")
+    cached = CONTENT_CACHE.get(full_path, st.st_size, st.st_mtime_ns)
+    if cached is not None:
+        content, digest = cached
+    else:
+        digest = indexed_hash(root, rel_path, st.st_size, st.st_mtime) if known_hash else None
+        if digest is not None and digest == known_hash: return None, digest
+        with open(full_path, 'rb') as f: raw = f.read()
+        digest = hash_bytes(raw)
+        # Same newline handling as text mode
+        content = raw.decode('utf-8', errors='replace').replace('\r\n', '\n').replace('\r', '\n')
+        CONTENT_CACHE.put(full_path, st.st_size, st.st_mtime_ns, content, digest)
+        remember_hash(root, rel_path, st.st_size, st.st_mtime, digest)
+    if known_hash and digest == known_hash: return None, digest
+    return content, digest
+
+# --- Ranged Reads ---
+class LineIndex:
+    """
+    Newline counts per fixed-size block of a file. The offset of any line is
+    a bisect over the blocks plus a scan of one block, so line lookups in
+    huge files cost the same anywhere in the file.
+    """
+    def __init__(self, f, block):
+        self.block = block
+        self.before = array('q')  # Newlines ahead of each block
+        total, size, last = 0, 0, b''
+        f.seek(0)
+        for data in iter(lambda: f.read(block), b''):
+            self.before.append(total)
+            total += data.count(b'\n')
+            size += len(data)
+            last = data[-1:]
+        self.size = size
+        self.newlines = total
+        self.lines = total + (1 if last not in (b'', b'\n') else 0)
+
+    def line_offset(self, f, line):
+        """Byte offset where 1-based `line` starts (the file size past the last line)."""
+        target = line - 1  # Line N starts after the (N-1)th newline
+        if target <= 0: return 0
+        if target > self.newlines: return self.size
+        b = bisect.bisect_left(self.before, target) - 1
+        f.seek(b * self.block)
+        data = f.read(self.block)
+        pos = -1
+        for _ in range(target - self.before[b]):
+            pos = data.find(b'\n', pos + 1)
+            if pos < 0: return self.size  # File changed under us
+        return b * self.block + pos + 1
+
+class LineIndexCache:
+    """Recently used LineIndexes, each valid for one (size, mtime_ns) of its file."""
+    def __init__(self, max_files, block):
+        self.max_files = max_files
+        self.block = block
+        self.entries = OrderedDict()  # full path -> ((size, mtime_ns), LineIndex)
+        self.lock = threading.Lock()
+        self.hits = self.builds = 0
+        self.build_seconds = 0.0
+
+    def get(self, full_path, f, st):
+        key = (st.st_size, st.st_mtime_ns)
+        with self.lock:
+            entry = self.entries.get(full_path)
+            if entry and entry[0] == key:
+                self.entries.move_to_end(full_path)
+                self.hits += 1
+                return entry[1]
+        start = time.perf_counter()
+        index = LineIndex(f, self.block)
+        with self.lock:
+            self.builds += 1
+            self.build_seconds += time.perf_counter() - start
+            self.entries[full_path] = (key, index)
+            self.entries.move_to_end(full_path)
+            while len(self.entries) > self.max_files: self.entries.popitem(last=False)
+        return index
+
+    def stats(self):
+        with self.lock:
+            return {"files": len(self.entries), "blocks": sum(len(e[1].before) for e in self.entries.values()),
+                    "hits": self.hits, "builds": self.builds, "build_seconds": round(self.build_seconds, 3)}
+
+LINE_INDEXES = LineIndexCache(CONFIG['LINE_INDEX_FILES'], CONFIG['LINE_INDEX_BLOCK'])
+
+def read_range(root, rel_path, offset=None, length=None, start_line=None, end_line=None):
+    """
+    Reads part of a file of any size without loading the rest: a byte range
+    (offset, length) or a 1-based inclusive line range. Line reads are cut
+    back to whole lines if they hit RANGE_MAX_BYTES. Raises OSError, or
+    ValueError for bad arguments.
+    """
+    max_bytes = CONFIG['RANGE_MAX_BYTES']
+    full_path = os.path.join(root.dir, rel_path)
+    with open(full_path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        result = {"path": rel_path, "size": st.st_size, "mtime": st.st_mtime}
+        if start_line is None and end_line is None:
+            start = max(0, int(offset or 0))
+            end = min(st.st_size, start + (max_bytes if length is None else max(0, int(length))))
+        else:
+            first = max(1, int(start_line if start_line is not None else 1))
+            last = int(end_line if end_line is not None else first)
+            if last < first: raise ValueError("end_line is before start_line")
+            index = LINE_INDEXES.get(full_path, f, st)
+            start, end = index.line_offset(f, first), index.line_offset(f, last + 1)
+            # Past the end the window is empty: end_line = start_line - 1
+            result.update(start_line=first, end_line=max(first - 1, min(last, index.lines)), total_lines=index.lines)
+        f.seek(start)
+        raw = f.read(min(max(0, end - start), max_bytes))
+    truncated = end - start > len(raw)
+    if truncated and 'start_line' in result:
+        cut = raw.rfind(b'\n')
+        if cut >= 0: raw = raw[:cut + 1]
+        result['end_line'] = result['start_line'] + max(0, raw.count(b'\n') - 1)
+    result.update(offset=start, length=len(raw), truncated=truncated, eof=start + len(raw) >= st.st_size,
+                  content=raw.decode('utf-8', errors='replace').replace('\r\n', '\n').replace('\r', '\n'))
+    return result
+
+# --- Writes ---
+# Applied to staged files that don't replace an existing one (mkstemp creates them 0600)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def stage_file(full_path, data, sync=False):
+    """
+    Writes data to a hidden temp file next to full_path (hidden files are
+    never indexed) and returns its path, ready to be renamed into place.
+    """
+    target_dir = os.path.dirname(full_path)
+    os.makedirs(target_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.genclaude-', suffix='.tmp', dir=target_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        try: shutil.copymode(full_path, tmp_path)
+        except OSError: os.chmod(tmp_path, 0o666 & ~_UMASK)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path
+
+def fsync_dirs(dirs):
+    """Makes renames durable, one fsync per directory. Not possible on Windows."""
+    if os.name == 'nt': return
+    for d in dirs:
+        try:
+            fd = os.open(d, os.O_RDONLY)
+            try: os.fsync(fd)
+            finally: os.close(fd)
+        except OSError: pass
+
+def store_file(root, rel_path, data):
+    """Writes bytes to a file and records it in the index. Caller holds root.write_lock. Returns the new hash."""
+    full_path = os.path.join(root.dir, rel_path)
+    if os.path.islink(full_path):
+        # Write through symlinks instead of replacing them
+        with open(full_path, 'wb') as f: f.write(data)
+    else:
+        os.replace(stage_file(full_path, data), full_path)
+    digest = hash_bytes(data)
+    # None (e.g. now over MAX_FILE_SIZE) drops an existing entry
+    stats = stat_for_index(full_path)
+    apply_index_changes(root, {rel_path: stats})
+    if stats is not None: remember_hash(root, rel_path, stats[0], stats[1], digest)
+    return digest
+
+class BatchTransaction:
+    """
+    Applies a group of writes and moves all-or-nothing. Contents are staged
+    and fsynced first, then everything is renamed into place; whatever was
+    replaced is kept as a hidden backup until commit, so any failure can be
+    rolled back to the previous state. Only files and symlinks are ever
+    replaced; a directory in the way fails the transaction.
+    """
+    def __init__(self):
+        self.undo = []
+        self.cleanup = []
+        self.touched_dirs = set()
+
+    def makedirs(self, path):
+        """os.makedirs that records the directories it creates, so rollback removes them again."""
+        missing = []
+        while not os.path.isdir(path):
+            missing.append(path)
+            parent = os.path.dirname(path)
+            if parent == path: break
+            path = parent
+        for d in reversed(missing):
+            os.mkdir(d)
+            self.undo.append(lambda d=d: os.rmdir(d))
+
+    def _backup(self, full_path):
+        """Keeps the current file at full_path restorable. Returns the backup path or None."""
+        if not os.path.lexists(full_path): return None
+        if os.path.isdir(full_path) and not os.path.islink(full_path): raise IsADirectoryError(f"Is a directory: {full_path}")
+        backup = os.path.join(os.path.dirname(full_path), f".genclaude-bak-{os.getpid()}-{len(self.undo)}-{os.path.basename(full_path)}")
+        if os.path.isfile(full_path) and not os.path.islink(full_path):
+            try:
+                os.link(full_path, backup)
+                self.cleanup.append(backup)
+                return backup
+            except OSError: pass
+        os.replace(full_path, backup)
+        self.cleanup.append(backup)
+        return backup
+
+    def _restore(self, backup, full_path):
+        """Puts a backup back if the operation that followed it failed before taking its place."""
+        if backup and not os.path.lexists(full_path): os.replace(backup, full_path)
+
+    def replace(self, tmp_path, full_path):
+        backup = self._backup(full_path)
+        try: os.replace(tmp_path, full_path)
+        except OSError:
+            self._restore(backup, full_path)
+            raise
+        self.touched_dirs.add(os.path.dirname(full_path))
+        self.undo.append(lambda: os.replace(backup, full_path) if backup else os.remove(full_path))
+
+    def move(self, full_src, full_dst):
+        """Moves like /api/move: onto an existing directory means into it. Returns the final path."""
+        full_dst = moved_target(full_src, full_dst)
+        self.makedirs(os.path.dirname(full_dst))
+        backup = self._backup(full_dst)
+        try: os.rename(full_src, full_dst)
+        except OSError:
+            self._restore(backup, full_dst)
+            raise
+        self.touched_dirs.update((os.path.dirname(full_src), os.path.dirname(full_dst)))
+        def undo():
+            os.rename(full_dst, full_src)
+            if backup: os.replace(backup, full_dst)
+        self.undo.append(undo)
+        return full_dst
+
+    def commit(self):
+        fsync_dirs(self.touched_dirs)
+        for path in self.cleanup:
+            try: os.remove(path)
+            except OSError: pass
+
+    def rollback(self):
+        errors = []
+        for undo in reversed(self.undo):
+            try: undo()
+            except OSError as e: errors.append(str(e))
+        return errors
+
+class PatchError(Exception):
+    pass
+
+_HUNK_RE = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+def _split_lines(text):
+    """Splits on \n only, keeping line endings (str.splitlines also splits on \f, \x1c, ...)."""
+    parts = text.split('\n')
+    lines = [line + '\n' for line in parts[:-1]]
+    if parts[-1]: lines.append(parts[-1])
+    return lines
+
+def apply_unified_diff(text, diff):
+    """Applies a unified diff to text. Every context and removed line must match exactly."""
+    src = _split_lines(text)
+    # (tag, line) pairs; "\ No newline at end of file" strips the previous line's newline
+    ops = []
+    for line in _split_lines(diff):
+        if line.startswith('\\'):
+            if ops and ops[-1][1].endswith('\n'): ops[-1] = (ops[-1][0], ops[-1][1][:-1])
+        elif line == '\n':
+            ops.append((' ', '\n'))
+        else:
+            ops.append((line[:1], line[1:]))
+
+    out, pos, i = [], 0, 0
+    while i < len(ops) and not (ops[i][0] == '@' and ops[i][1].startswith('@')): i += 1
+    if i == len(ops): raise PatchError("No hunks in patch")
+    while i < len(ops):
+        m = _HUNK_RE.match(ops[i][0] + ops[i][1])
+        if not m: raise PatchError(f"Bad hunk header: {ops[i][0] + ops[i][1]!r}")
+        old_start, old_len = int(m.group(1)), int(m.group(2) or 1)
+        new_len = int(m.group(4) or 1)
+        start = old_start - 1 if old_len else old_start
+        if start < pos or start > len(src): raise PatchError(f"Hunk at line {old_start} is out of range")
+        out.extend(src[pos:start])
+        pos = start
+        i += 1
+        seen_old = seen_new = 0
+        while i < len(ops) and ops[i][0] in (' ', '-', '+'):
+            tag, line = ops[i]
+            if tag in (' ', '-'):
+                if pos >= len(src) or src[pos] != line:
+                    raise PatchError(f"Patch does not apply at line {pos + 1}")
+                pos += 1
+                seen_old += 1
+            if tag in (' ', '+'):
+                out.append(line)
+                seen_new += 1
+            i += 1
+        if seen_old != old_len or seen_new != new_len:
+            raise PatchError(f"Hunk at line {old_start} has the wrong line counts")
+        if i < len(ops) and not (ops[i][0] == '@' and ops[i][1].startswith('@')):
+            raise PatchError(f"Unexpected patch line: {ops[i][0] + ops[i][1]!r}")
+    out.extend(src[pos:])
+    return ''.join(out)
+
+def apply_block_delta(base, delta):
+    """
+    Builds new bytes from an rsync-style delta: a list of {"copy": [offset, length]}
+    (bytes from the base), {"data": text} or {"data_b64": base64} ops.
+    """
+    out = []
+    for op in delta:
+        if 'copy' in op:
+            offset, length = op['copy']
+            if offset < 0 or length < 0 or offset + length > len(base):
+                raise PatchError(f"Copy out of range: {offset}+{length}")
+            out.append(base[offset:offset + length])
+        elif 'data' in op:
+            out.append(op['data'].encode('utf-8'))
+        elif 'data_b64' in op:
+            out.append(base64.b64decode(op['data_b64']))
+        else:
+            raise PatchError(f"Unknown delta op: {op!r}")
+    return b''.join(out)
+
+READ_POOL = ThreadPoolExecutor(CONFIG['READ_WORKERS'], thread_name_prefix='genclaude-read')
+
+def read_record(root, rel_path, known_hash=None):
+    """One /api/batch-read result: content, an unchanged marker, or the reason it could not be read."""
+    try:
+        content, digest = read_text(root, rel_path, known_hash)
+        if content is None: return {"path": rel_path, "hash": digest, "unchanged": True}
+        return {"path": rel_path, "content": content, "hash": digest}
+    except Exception as e: return {"path": rel_path, "error": str(e)}
+
+def iter_batch_read(root, paths, known=None):
+    """
+    Yields read_record() results in completion order. At most twice the
+    pool size is in flight, so memory stays flat however long the batch.
+    """
+    window = CONFIG['READ_WORKERS'] * 2
+    pending = set()
+    try:
+        for rel_path in paths:
+            pending.add(READ_POOL.submit(read_record, root, rel_path, known.get(rel_path) if known else None))
+            if len(pending) >= window:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done: yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done: yield future.result()
+    finally:
+        # Client went away: don't read files nobody will receive
+        for future in pending: future.cancel()
+
 # --- Watchdog ---
-event_queue = queue.Queue()
+
+def index_paths_under(root, rel_dir):
+    """Indexed paths inside a directory (caller must hold root.lock)."""
+    return root.index.paths_under(rel_dir)
+
+def moved_target(full_src, full_dst):
+    """Where a move ends up: like shutil.move, onto an existing directory means into it."""
+    if os.path.isdir(full_dst): return os.path.join(full_dst, os.path.basename(os.path.normpath(full_src)))
+    return full_dst
+
+def move_changes(root, src, full_dst, was_dir):
+    """Index changes for src (a file, or a directory if was_dir) now living at full_dst."""
+    changes = {}
+    if was_dir:
+        with root.lock: changes = {k: None for k in index_paths_under(root, src)}
+    else: changes[src] = None
+    dst_rel = get_relative_path(root, full_dst)
+    if was_dir:
+        for k, v in walk_tree(root, dst_rel).items(): changes[k] = (v["size"], v["mtime"])
+    elif is_valid_file(root, full_dst, dst_rel): changes[dst_rel] = stat_for_index(full_dst)
+    return changes
+
+def apply_index_changes(root, changes):
+    """
+    Applies {rel_path: (size, mtime) or None} to the index in one locked
+    step and publishes what actually changed. Entries that already match
+    produce no event, which is how watchdog echoes of our own writes die.
+    """
+    events = []
+    for rel_path in changes: CONTENT_CACHE.invalidate(os.path.join(root.dir, rel_path))
+    with root.lock:
+        for rel_path, stats in changes.items():
+            old = root.index.stats(rel_path)
+            if stats is None:
+                if index_remove(root, rel_path): events.append(("deleted", rel_path))
+            elif old is None:
+                index_put(root, rel_path, stats[0], stats[1])
+                events.append(("created", rel_path))
+            elif old != stats:
+                index_put(root, rel_path, stats[0], stats[1])
+                events.append(("modified", rel_path))
+    publish_changes(root, events)
+    return events
+
+def publish_changes(root, events):
+    """Sends change events to SSE clients, batching when there is more than one."""
+    now = time.time()
+    batch_max = CONFIG['EVENT_BATCH_MAX']
+    for i in range(0, len(events), batch_max):
+        chunk = events[i:i + batch_max]
+        if len(chunk) == 1:
+            EVENT_HUB.publish({"type": chunk[0][0], "path": chunk[0][1], "timestamp": now}, root.name)
+        else:
+            EVENT_HUB.publish({"type": "batch", "events": [{"type": t, "path": p} for t, p in chunk], "timestamp": now}, root.name)
+
+def stat_for_index(full_path):
+    """(size, mtime) if the path is an indexable regular file, else None."""
+    try: st = os.stat(full_path)
+    except OSError: return None
+    if not stat.S_ISREG(st.st_mode) or st.st_size > CONFIG['MAX_FILE_SIZE']: return None
+    return (st.st_size, st.st_mtime)
+
+# --- Event Pipeline ---
+class EventCoalescer:
+    """
+    Sits between watchdog and the index. Raw events only record which
+    paths are dirty; one worker, shared by all roots, wakes after
+    EVENT_DEBOUNCE seconds, stats the dirty paths outside the index lock
+    and hands the results to apply_index_changes, one batch per root.
+    Event types are derived from the before/after state, so a
+    create -> modify -> delete of a temp file yields nothing.
+    """
+    def __init__(self, window):
+        self.window = window
+        self.lock = threading.Lock()
+        self.pending = {}       # root -> {rel_path: full_path}
+        self.pending_dirs = {}  # root -> {rel_dir: full_path}
+        self.counts = {}        # root name -> [raw events, coalesced events, batches]
+        self.wake = threading.Event()
+        self.started = False
+
+    def _count(self, root):
+        counts = self.counts.get(root.name)
+        if counts is None: counts = self.counts[root.name] = [0, 0, 0]
+        return counts
+
+    def add(self, root, rel_path, full_path):
+        with self.lock:
+            self._count(root)[0] += 1
+            self.pending.setdefault(root, {})[rel_path] = full_path
+        self.wake.set()
+
+    def add_dir(self, root, rel_dir, full_path):
+        """A directory appeared, vanished or moved: its subtree gets re-checked."""
+        with self.lock:
+            self._count(root)[0] += 1
+            self.pending_dirs.setdefault(root, {})[rel_dir] = full_path
+        self.wake.set()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            pending_dirs, self.pending_dirs = self.pending_dirs, {}
+        events = []
+        for root in pending.keys() | pending_dirs.keys():
+            events += self.flush_root(root, pending.get(root, {}), pending_dirs.get(root, {}))
+        return events
+
+    def flush_root(self, root, pending, pending_dirs):
+        changes = {}
+        for rel_dir, full_path in pending_dirs.items():
+            with root.lock: known = index_paths_under(root, rel_dir)
+            found = walk_tree(root, rel_dir, workers=1) if os.path.isdir(full_path) else {}
+            for rel_path in known:
+                if rel_path not in found: changes[rel_path] = None
+            for rel_path, entry in found.items():
+                changes[rel_path] = (entry["size"], entry["mtime"])
+        for rel_path, full_path in pending.items():
+            changes[rel_path] = stat_for_index(full_path)
+
+        events = apply_index_changes(root, changes)
+        with self.lock:
+            counts = self._count(root)
+            counts[1] += len(events)
+            counts[2] += 1
+        return events
+
+    def run(self):
+        while True:
+            self.wake.wait()
+            time.sleep(self.window)
+            self.wake.clear()
+            try: self.flush()
+            except Exception as e: print(f"{C_RED}[Events] Failed to apply changes: {e}{C_RESET}")
+
+    def start(self):
+        with self.lock:
+            if self.started: return
+            self.started = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stats(self, root=None):
+        """Counters for one root, or summed over all of them."""
+        with self.lock:
+            if root is not None:
+                raw, coalesced, batches = self.counts.get(root.name, (0, 0, 0))
+                pending = len(self.pending.get(root, ())) + len(self.pending_dirs.get(root, ()))
+            else:
+                raw, coalesced, batches = (sum(c[i] for c in self.counts.values()) for i in range(3))
+                pending = sum(map(len, self.pending.values())) + sum(map(len, self.pending_dirs.values()))
+            return {"raw": raw, "coalesced": coalesced, "batches": batches, "pending": pending}
+
+EVENT_COALESCER = EventCoalescer(CONFIG['EVENT_DEBOUNCE'])
 
 class ChangeHandler(FileSystemEventHandler):
+    # Access notifications (watchdog >= 2.3) don't change anything we index
+    SKIP_TYPES = {'opened', 'closed_no_write'}
+    # Only these change which files a directory holds
+    DIR_TYPES = {'created', 'deleted', 'moved'}
+
+    def __init__(self, root):
+        super().__init__()
+        self.root = root
+
     def on_any_event(self, event):
-        if event.is_directory: return
-        rel_path = get_relative_path(event.src_path)
-        if not is_valid_file(event.src_path, rel_path): return
-        event_type = event.event_type
-
-        with INDEX_LOCK:
-            if event_type == 'deleted':
-                if rel_path in FILE_INDEX: del FILE_INDEX[rel_path]
-            elif event_type == 'moved':
-                if rel_path in FILE_INDEX: del FILE_INDEX[rel_path]
-                if event.dest_path:
-                    dest_rel = get_relative_path(event.dest_path)
-                    if is_valid_file(event.dest_path, dest_rel):
-                         FILE_INDEX[dest_rel] = {
-                             "size": os.path.getsize(event.dest_path) if os.path.exists(event.dest_path) else 0,
-                             "mtime": os.path.getmtime(event.dest_path) if os.path.exists(event.dest_path) else 0
-                         }
-            else:
-                if os.path.exists(event.src_path):
-                     FILE_INDEX[rel_path] = {
-                         "size": os.path.getsize(event.src_path),
-                         "mtime": os.path.getmtime(event.src_path)
-                     }
+        if event.event_type in self.SKIP_TYPES: return
+        if event.is_directory and event.event_type not in self.DIR_TYPES: return
+        paths = [event.src_path]
+        if event.event_type == 'moved' and event.dest_path: paths.append(event.dest_path)
+        root = self.root
+        for path in paths:
+            rel_path = get_relative_path(root, path)
+            if event.is_directory:
+                if rel_path != '.' and not is_path_excluded(root, rel_path): EVENT_COALESCER.add_dir(root, rel_path, path)
+            elif is_valid_file(root, path, rel_path):
+                EVENT_COALESCER.add(root, rel_path, path)
+
+def join_rel(rel_dir, name):
+    return f"{rel_dir}/{name}" if rel_dir else name
+
+def _scan_dir(root, rel_dir):
+    """
+    Lists one directory. Returns (files, subdirs, dir_mtime) where files
+    maps rel_path -> entry for valid direct children and subdirs are the
+    relative paths that should be descended into.
+    """
+    full_dir = os.path.join(root.dir, rel_dir)
+    dir_mtime = os.stat(full_dir).st_mtime
+    max_size = CONFIG['MAX_FILE_SIZE']
+    ignore_dirs = root.ignore_dirs
+    files, subdirs = {}, []
+    with os.scandir(full_dir) as it:
+        for entry in it:
+            name = entry.name
+            rel_path = join_rel(rel_dir, name)
+            try: is_dir = entry.is_dir()
+            except OSError: continue
+            if is_dir:
+                # Filter directories (case insensitive), never follow symlinks
+                if name in ignore_dirs or name.lower() in ignore_dirs or name.startswith('.'): continue
+                if entry.is_symlink() or is_path_excluded(root, rel_path): continue
+                subdirs.append(rel_path)
+            elif is_valid_file(root, entry.path, rel_path):
+                try:
+                    stats = entry.stat()
+                    if stats.st_size <= max_size:
+                        files[rel_path] = { "size": stats.st_size, "mtime": stats.st_mtime }
+                except OSError: pass
+    return files, subdirs, dir_mtime
+
+def walk_tree(root, rel_dir="", dir_mtimes=None, workers=None):
+    """
+    Walks a directory and returns {rel_path: entry} for every valid file in it.
+    Directories are handed out to a pool of threads through a shared queue;
+    each thread fills its own dicts, which are merged once at the end.
+    """
+    workers = workers or CONFIG['INDEX_WORKERS']
+    if workers <= 1:
+        new_index = {}
+        pending = [rel_dir]
+        while pending:
+            current = pending.pop()
+            try: files, subdirs, dir_mtime = _scan_dir(root, current)
+            except OSError: continue
+            new_index.update(files)
+            pending.extend(subdirs)
+            if dir_mtimes is not None: dir_mtimes[current] = dir_mtime
+        return new_index
+
+    work = queue.Queue()
+    results = []
 
-        payload = {"type": event_type, "path": rel_path.replace("\\", "/"), "timestamp": time.time()}
-        event_queue.put(payload)
+    def worker():
+        files, mtimes = {}, {}
+        results.append((files, mtimes))
+        while True:
+            current = work.get()
+            if current is None: break
+            try:
+                found, subdirs, dir_mtime = _scan_dir(root, current)
+                files.update(found)
+                mtimes[current] = dir_mtime
+                for sub in subdirs: work.put(sub)
+            except OSError: pass
+            finally: work.task_done()
+
+    work.put(rel_dir)
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for t in threads: t.start()
+    work.join()
+    for _ in threads: work.put(None)
+    for t in threads: t.join()
 
-def build_index():
-    print(f"{C_GREY}[Index] Building file index...{C_RESET}")
     new_index = {}
-    for root, dirs, filenames in os.walk(CONFIG['ROOT_DIR']):
-        rel_dir = get_relative_path(root)
-        if rel_dir == ".": rel_dir = ""
+    for files, mtimes in results:
+        new_index.update(files)
+        if dir_mtimes is not None: dir_mtimes.update(mtimes)
+    return new_index
+
+def build_index(root):
+    print(f"{C_GREY}[Index] {root.name}: building file index...{C_RESET}")
+    start = time.time()
+    dir_mtimes = {}
+    new_index = walk_tree(root, "", dir_mtimes)
+    with root.lock:
+        index_replace(root, new_index)
+        root.dir_mtimes.clear()
+        root.dir_mtimes.update(dir_mtimes)
+    METRICS.record_timing('scan', time.time() - start, root.name)
+    print(f"{C_GREEN}[Index] {root.name}: complete. Indexed {len(root.index)} files in {time.time() - start:.2f}s.{C_RESET}")
+
+# --- Index Snapshot ---
+# Each root keeps the directory mtimes recorded at scan time. A directory
+# whose mtime still matches has the same set of entries, so only its files
+# need a stat.
+def _snapshot_path(root):
+    return os.path.join(root.dir, CONFIG['SNAPSHOT_FILE'])
+
+def _rules_fingerprint(root):
+    rules = [sorted(root.ignore_dirs), sorted(root.custom_patterns), sorted(root.excluded_paths), CONFIG['MAX_FILE_SIZE']]
+    return hashlib.sha1(json.dumps(rules).encode('utf-8')).hexdigest()
+
+def save_index_snapshot(root):
+    """Writes the index to a gzipped JSON snapshot, grouped by directory."""
+    with root.lock:
+        cursor = make_cursor(root)
+        if cursor == root.snapshot['saved_cursor']: return False
+        items = list(root.index.items())
+        dir_mtimes = dict(root.dir_mtimes)
+    grouped = {}
+    for rel_path, v in items:
+        rel_dir, _, name = rel_path.rpartition('/')
+        record = [name, v["size"], v["mtime"]]
+        if v.get("hash"): record.append(v["hash"])
+        grouped.setdefault(rel_dir, []).append(record)
+    data = {
+        'version': 1,
+        'root': root.dir,
+        'rules': _rules_fingerprint(root),
+        'timestamp': time.time(),
+        'dirs': dir_mtimes,
+        'files': grouped
+    }
+    path = _snapshot_path(root)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=1) as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+        root.snapshot['saved_cursor'] = cursor
+        return True
+    except Exception as e:
+        print(f"{C_YELLOW}⚠ Failed to save index snapshot for {root.name}: {e}{C_RESET}")
+        return False
 
-        # Filter directories in-place (case insensitive)
-        dirs[:] = [d for d in dirs if d not in IGNORE_DIRS and d.lower() not in IGNORE_DIRS and not d.startswith('.') and not is_path_excluded(os.path.join(rel_dir, d).replace("\\", "/"))]
+def load_index_snapshot(root):
+    """Installs the saved index if it matches this root and ignore rules. Returns the snapshot or None."""
+    path = _snapshot_path(root)
+    if not os.path.exists(path): return None
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+    except Exception as e:
+        print(f"{C_YELLOW}⚠ Ignoring unreadable index snapshot: {e}{C_RESET}")
+        return None
+    if data.get('version') != 1 or data.get('root') != root.dir or data.get('rules') != _rules_fingerprint(root):
+        return None
 
-        for name in filenames:
-            path = os.path.join(root, name)
-            rel_path = get_relative_path(path)
-            if is_valid_file(path, rel_path):
-                try:
-                    stats = os.stat(path)
-                    if stats.st_size <= CONFIG['MAX_FILE_SIZE']:
-                        new_index[rel_path] = { "size": stats.st_size, "mtime": stats.st_mtime }
-                except: pass
-    with INDEX_LOCK:
-        FILE_INDEX.clear()
-        FILE_INDEX.update(new_index)
-    print(f"{C_GREEN}[Index] Complete. Indexed {len(FILE_INDEX)} files.{C_RESET}")
+    new_index = {}
+    for rel_dir, entries in data['files'].items():
+        for name, size, mtime, *digest in entries:
+            new_index[join_rel(rel_dir, name)] = { "size": size, "mtime": mtime, "hash": digest[0] } if digest else { "size": size, "mtime": mtime }
+    with root.lock:
+        index_replace(root, new_index)
+        root.dir_mtimes.clear()
+        root.dir_mtimes.update(data['dirs'])
+        root.snapshot['saved_cursor'] = make_cursor(root)
+    return data
+
+def same_stats(entry, stats):
+    if entry is None or stats is None: return entry is stats
+    return entry["size"] == stats["size"] and entry["mtime"] == stats["mtime"]
+
+def _reconcile_put(root, rel_path, expected, stats):
+    """Applies a stat result unless the entry changed since we looked at it."""
+    with root.lock:
+        if not same_stats(root.index.get(rel_path), expected): return False
+        if stats is None: return index_remove(root, rel_path)
+        index_put(root, rel_path, stats["size"], stats["mtime"])
+        return True
+
+def reconcile_snapshot(root, data):
+    """
+    Brings a loaded snapshot up to date with the disk. Directories whose
+    mtime changed are re-listed (and new subtrees walked); unchanged
+    directories only get their files re-stat'ed, since in-place edits do
+    not touch the directory mtime.
+    """
+    root.snapshot['reconciling'] = True
+    start = time.time()
+    changed_dirs = changed_files = 0
+    snap_dirs = data['dirs']
+    snap_files = data['files']
+    try:
+        for rel_dir in sorted(snap_dirs):
+            full_dir = os.path.join(root.dir, rel_dir)
+            known = {}
+            with root.lock:
+                for record in snap_files.get(rel_dir, []):
+                    rel_path = join_rel(rel_dir, record[0])
+                    entry = root.index.get(rel_path)
+                    if entry is not None: known[rel_path] = entry
+            try:
+                dir_mtime = os.stat(full_dir).st_mtime
+            except OSError:
+                with root.lock:
+                    for k in index_paths_under(root, rel_dir) if rel_dir else []: index_remove(root, k)
+                    root.dir_mtimes.pop(rel_dir, None)
+                changed_dirs += 1
+                continue
+
+            if dir_mtime == snap_dirs[rel_dir]:
+                for rel_path, entry in known.items():
+                    try:
+                        st = os.stat(os.path.join(root.dir, rel_path))
+                        stats = { "size": st.st_size, "mtime": st.st_mtime } if st.st_size <= CONFIG['MAX_FILE_SIZE'] else None
+                    except OSError: stats = None
+                    if not same_stats(entry, stats) and _reconcile_put(root, rel_path, entry, stats): changed_files += 1
+                continue
+
+            changed_dirs += 1
+            try: files, subdirs, dir_mtime = _scan_dir(root, rel_dir)
+            except OSError: continue
+            for rel_path, entry in known.items():
+                if rel_path not in files and _reconcile_put(root, rel_path, entry, None): changed_files += 1
+            for rel_path, stats in files.items():
+                if not same_stats(known.get(rel_path), stats) and _reconcile_put(root, rel_path, known.get(rel_path), stats): changed_files += 1
+            for sub in subdirs:
+                if sub in snap_dirs: continue
+                sub_mtimes = {}
+                for rel_path, stats in walk_tree(root, sub, sub_mtimes).items():
+                    if _reconcile_put(root, rel_path, None, stats): changed_files += 1
+                with root.lock: root.dir_mtimes.update(sub_mtimes)
+            with root.lock: root.dir_mtimes[rel_dir] = dir_mtime
+    finally:
+        root.snapshot['reconciling'] = False
+    METRICS.record_timing('snapshot_reconcile', time.time() - start, root.name)
+    print(f"{C_GREEN}[Index] {root.name}: reconciled snapshot in {time.time() - start:.2f}s ({changed_dirs} dirs re-scanned, {changed_files} files updated).{C_RESET}")
+
+def start_index(root):
+    """Serves from the saved snapshot when possible, otherwise builds from scratch."""
+    start = time.time()
+    data = load_index_snapshot(root)
+    if data is None:
+        build_index(root)
+        save_index_snapshot(root)
+        return
+    print(f"{C_GREEN}[Index] {root.name}: loaded snapshot with {len(root.index)} files in {(time.time() - start) * 1000:.0f}ms. Reconciling in background...{C_RESET}")
+    threading.Thread(target=reconcile_snapshot, args=(root, data), daemon=True).start()
+
+def start_snapshot_saver():
+    def loop():
+        while True:
+            time.sleep(CONFIG['SNAPSHOT_INTERVAL'])
+            for root in list(ROOTS.values()):
+                if not root.snapshot['reconciling']: save_index_snapshot(root)
+    threading.Thread(target=loop, daemon=True).start()
 
 def start_observer():
+    """One observer watches every root."""
     if not HAS_WATCHDOG: return None
     observer = Observer()
-    observer.schedule(ChangeHandler(), CONFIG['ROOT_DIR'], recursive=True)
+    for root in ROOTS.values(): observer.schedule(ChangeHandler(root), root.dir, recursive=True)
     observer.start()
+    EVENT_COALESCER.start()
     return observer
 
 
+# --- Polling Scanner ---
+class PollingScanner:
+    """
+    Change detection without watchdog, or for mounts where inotify stays
+    quiet. Every known directory is stat'ed in turn and re-listed only if
+    its mtime moved, which catches creates, deletes, renames and atomic
+    saves. A slower rolling sweep re-stats files for in-place edits. Both
+    share the stat budget each tick is given, and anything found goes
+    through EVENT_COALESCER exactly like a watchdog event. One scanner per
+    root; poll_roots() ticks them all from a single thread.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.dir_queue = []
+        self.file_dirs, self.file_names = [], []
+        self.dirs_checked = self.files_checked = self.stat_calls = 0
+        self.dir_rounds = self.file_rounds = self.changes = 0
+        self.last_dir_round = self.last_file_round = None
+
+    def _changed(self, rel_path):
+        self.changes += 1
+        EVENT_COALESCER.add(self.root, rel_path, os.path.join(self.root.dir, rel_path))
+
+    def _changed_dir(self, rel_dir):
+        self.changes += 1
+        EVENT_COALESCER.add_dir(self.root, rel_dir, os.path.join(self.root.dir, rel_dir))
+
+    def _forget_dir(self, rel_dir):
+        prefix = rel_dir + '/'
+        dir_mtimes = self.root.dir_mtimes
+        with self.root.lock:
+            for d in [d for d in dir_mtimes if d == rel_dir or d.startswith(prefix)]: del dir_mtimes[d]
+
+    def check_dir(self, rel_dir):
+        """Re-lists a directory if its mtime changed. Returns the stat calls spent."""
+        root = self.root
+        full_dir = os.path.join(root.dir, rel_dir)
+        with root.lock: known_mtime = root.dir_mtimes.get(rel_dir, -1)
+        if known_mtime == -1: return 0  # forgotten since the round started
+        try: dir_mtime = os.stat(full_dir).st_mtime
+        except OSError:
+            if rel_dir:
+                self._forget_dir(rel_dir)
+                self._changed_dir(rel_dir)
+            return 1
+        if dir_mtime == known_mtime: return 1
+
+        try: files, subdirs, dir_mtime = _scan_dir(root, rel_dir)
+        except OSError: return 1
+        with root.lock:
+            indexed = [join_rel(rel_dir, name) for name in root.index.dirs.get(rel_dir, ())]
+            gone = [p for p in indexed if p not in files]
+            changed = [p for p, entry in files.items() if root.index.stats(p) != (entry["size"], entry["mtime"])]
+            known_subdirs = {d for d in root.dir_mtimes if d and d.rpartition('/')[0] == rel_dir}
+            root.dir_mtimes[rel_dir] = dir_mtime
+            for sub in subdirs:
+                # Unknown mtime: the next directory pass lists it
+                if sub not in known_subdirs: root.dir_mtimes[sub] = None
+        for rel_path in gone + changed: self._changed(rel_path)
+        for sub in subdirs:
+            if sub not in known_subdirs: self._changed_dir(sub)
+        for sub in known_subdirs - set(subdirs):
+            self._forget_dir(sub)
+            self._changed_dir(sub)
+        return 1 + len(files) + len(subdirs)
+
+    def check_file(self, rel_path):
+        if stat_for_index(os.path.join(self.root.dir, rel_path)) != self.root.index.stats(rel_path): self._changed(rel_path)
+
+    def _dir_pass(self, budget):
+        spent, refilled = 0, False
+        while spent < budget:
+            if not self.dir_queue:
+                # At most one round per tick, so small trees don't spin
+                if refilled: break
+                refilled = True
+                if self.last_dir_round is not None: self.dir_rounds += 1
+                self.last_dir_round = time.time()
+                with self.root.lock: self.dir_queue = sorted(self.root.dir_mtimes, reverse=True)
+                if not self.dir_queue: break
+            spent += self.check_dir(self.dir_queue.pop())
+            self.dirs_checked += 1
+        return spent
+
+    def _file_pass(self, budget):
+        spent, refilled = 0, False
+        while spent < budget:
+            if not self.file_names:
+                if not self.file_dirs:
+                    if refilled: break
+                    refilled = True
+                    if self.last_file_round is not None: self.file_rounds += 1
+                    self.last_file_round = time.time()
+                    with self.root.lock: self.file_dirs = sorted(self.root.index.dirs, reverse=True)
+                    if not self.file_dirs: break
+                rel_dir = self.file_dirs.pop()
+                with self.root.lock: self.file_names = [join_rel(rel_dir, name) for name in self.root.index.dirs.get(rel_dir, ())]
+                continue
+            self.check_file(self.file_names.pop())
+            self.files_checked += 1
+            spent += 1
+        return spent
+
+    def tick(self, budget):
+        spent = self._dir_pass(budget // 2)
+        spent += self._file_pass(budget - spent)
+        self.stat_calls += spent
+
+    def stats(self):
+        return {"running": POLL_STATE['running'], "stat_calls": self.stat_calls, "dirs_checked": self.dirs_checked, "files_checked": self.files_checked,
+                "dir_rounds": self.dir_rounds, "file_rounds": self.file_rounds, "changes": self.changes}
+
+POLL_STATE = {'running': False, 'thread': None, 'stop': threading.Event()}
+
+def poll_roots():
+    """The polling thread. POLL_STAT_RATE is split evenly between the roots."""
+    stop = POLL_STATE['stop']
+    while not stop.is_set():
+        start = time.time()
+        roots = list(ROOTS.values())
+        budget = max(2, int(CONFIG['POLL_STAT_RATE'] * CONFIG['POLL_INTERVAL'] / max(1, len(roots))))
+        for root in roots:
+            try: root.poller.tick(budget)
+            except Exception as e: print(f"{C_RED}[Poll] {root.name}: scan failed: {e}{C_RESET}")
+        stop.wait(max(0.0, CONFIG['POLL_INTERVAL'] - (time.time() - start)))
+
+def start_poller(force=False):
+    """Starts polling if POLL_MODE asks for it (or `force`). Returns whether the poller runs."""
+    mode = CONFIG['POLL_MODE']
+    if not force and (mode == 'off' or (mode == 'auto' and HAS_WATCHDOG)): return False
+    if POLL_STATE['running']: return True
+    POLL_STATE['running'] = True
+    POLL_STATE['stop'].clear()
+    EVENT_COALESCER.start()
+    POLL_STATE['thread'] = threading.Thread(target=poll_roots, daemon=True)
+    POLL_STATE['thread'].start()
+    print(f"{C_GREEN}[Poll] Polling for changes ({CONFIG['POLL_STAT_RATE']} stat calls/s).{C_RESET}")
+    return True
+
+def stop_poller():
+    """Stops the polling thread after its current tick."""
+    if not POLL_STATE['running']: return
+    POLL_STATE['stop'].set()
+    POLL_STATE['thread'].join()
+    POLL_STATE['running'] = False
+
+# --- Exec Jobs ---
+class JobQueueFull(Exception): pass
+
+class Job:
+    """
+    One /api/exec command. Output is kept as numbered chunks so streaming
+    clients can resume with ?after=<seq>; once more than `output_bytes`
+    are held the oldest chunks are dropped.
+    """
+    def __init__(self, job_id, root, command, timeout, output_bytes):
+        self.id = job_id
+        self.root = root
+        self.command = command
+        self.timeout = timeout
+        self.output_bytes = output_bytes
+        self.state = 'queued'
+        self.code = None
+        self.created, self.started, self.finished = time.time(), None, None
+        self.proc = None
+        self.cancel_requested = False
+        self.chunks = deque()
+        self.next_seq = 1
+        self.held_bytes = 0
+        self.total_bytes = 0
+        self.cond = threading.Condition()
+        self.wakers = set()
+
+    @property
+    def done(self):
+        return self.state in ('exited', 'failed', 'cancelled', 'timeout')
+
+    def append(self, stream_name, text):
+        with self.cond:
+            self.chunks.append((self.next_seq, stream_name, text))
+            self.next_seq += 1
+            self.held_bytes += len(text)
+            self.total_bytes += len(text)
+            while self.held_bytes > self.output_bytes and len(self.chunks) > 1:
+                self.held_bytes -= len(self.chunks.popleft()[2])
+            self.cond.notify_all()
+        self.wake()
+
+    def set_state(self, state, code=None):
+        with self.cond:
+            self.state = state
+            if code is not None: self.code = code
+            if state == 'running': self.started = time.time()
+            if self.done: self.finished = time.time()
+            self.cond.notify_all()
+        self.wake()
+        EVENT_HUB.publish({"type": "job", "id": self.id, "state": state, "code": self.code, "timestamp": time.time()}, self.root.name)
+
+    def wake(self):
+        for waker in list(self.wakers): waker()
+
+    def output_after(self, after, timeout=0):
+        """Waits up to `timeout` for chunks past `after`. Returns (chunks, dropped, done)."""
+        with self.cond:
+            deadline = time.time() + timeout
+            while self.next_seq - 1 <= after and not self.done and time.time() < deadline:
+                self.cond.wait(deadline - time.time())
+            first = self.chunks[0][0] if self.chunks else self.next_seq
+            chunks = list(islice(self.chunks, max(0, after + 1 - first), None))
+            return chunks, after + 1 < first, self.done
+
+    def info(self):
+        with self.cond:
+            return {"id": self.id, "root": self.root.name, "command": self.command, "state": self.state, "code": self.code, "timeout": self.timeout,
+                    "created": self.created, "started": self.started, "finished": self.finished,
+                    "output_bytes": self.total_bytes, "last_seq": self.next_seq - 1,
+                    "output_truncated": self.total_bytes > self.held_bytes}
+
+def kill_process(proc):
+    """Kills a job's whole process group (shell=True spawns children)."""
+    try:
+        if os.name == 'posix': os.killpg(proc.pid, signal.SIGKILL)
+        else: proc.kill()
+    except (ProcessLookupError, PermissionError, OSError): pass
+
+class JobManager:
+    """Runs at most `max_running` jobs at once, across all roots; up to `max_queued` more wait their turn."""
+    def __init__(self, max_running, max_queued, keep, output_bytes):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.keep = keep
+        self.output_bytes = output_bytes
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        self.waiting = deque()
+        self.running = 0
+        self.counter = 0
+
+    def submit(self, root, command, timeout):
+        with self.lock:
+            if len(self.waiting) >= self.max_queued and self.running >= self.max_running: raise JobQueueFull()
+            self.counter += 1
+            job = Job(f"{int(time.time())}-{self.counter}", root, command, timeout, self.output_bytes)
+            self.jobs[job.id] = job
+            self.waiting.append(job)
+            self._prune()
+        self._dispatch()
+        return job
+
+    def get(self, job_id):
+        with self.lock: return self.jobs.get(job_id)
+
+    def list(self, root=None):
+        with self.lock: jobs = [job for job in self.jobs.values() if root is None or job.root is root]
+        return [job.info() for job in jobs]
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None: return None
+            job.cancel_requested = True
+            if job in self.waiting:
+                self.waiting.remove(job)
+                queued = True
+            else: queued = False
+        if queued: job.set_state('cancelled')
+        elif job.proc is not None: kill_process(job.proc)
+        return job
+
+    def stats(self, root=None):
+        with self.lock:
+            if root is None: return {"running": self.running, "queued": len(self.waiting), "retained": len(self.jobs)}
+            jobs = [job for job in self.jobs.values() if job.root is root]
+            return {"running": sum(job.state == 'running' for job in jobs), "queued": sum(job.state == 'queued' for job in jobs), "retained": len(jobs)}
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        for job_id in finished[:max(0, len(self.jobs) - self.keep)]: del self.jobs[job_id]
+
+    def _dispatch(self):
+        while True:
+            with self.lock:
+                if self.running >= self.max_running or not self.waiting: return
+                job = self.waiting.popleft()
+                self.running += 1
+            threading.Thread(target=self._run, args=(job,), daemon=True).start()
+
+    def _pump(self, job, pipe, stream_name):
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        for data in iter(lambda: pipe.read1(65536), b''):
+            text = decoder.decode(data)
+            if text: job.append(stream_name, text)
+        tail = decoder.decode(b'', final=True)
+        if tail: job.append(stream_name, tail)
+        pipe.close()
+
+    def _run(self, job):
+        try: self._execute(job)
+        except Exception as e:
+            job.append('stderr', str(e))
+            if job.proc is not None: kill_process(job.proc)
+            job.set_state('failed')
+        finally:
+            with self.lock:
+                self.running -= 1
+                self._prune()
+            self._dispatch()
+
+    def _execute(self, job):
+        job.proc = subprocess.Popen(job.command, shell=True, cwd=job.root.dir, stdin=subprocess.DEVNULL,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=(os.name == 'posix'))
+        job.set_state('running')
+        if job.cancel_requested: kill_process(job.proc)
+        pumps = [threading.Thread(target=self._pump, args=(job, pipe, name), daemon=True)
+                 for pipe, name in ((job.proc.stdout, 'stdout'), (job.proc.stderr, 'stderr'))]
+        for t in pumps: t.start()
+        timed_out = False
+        try: job.proc.wait(timeout=job.timeout)
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            kill_process(job.proc)
+            job.proc.wait()
+        for t in pumps: t.join()
+        if timed_out: job.set_state('timeout', job.proc.returncode)
+        elif job.cancel_requested: job.set_state('cancelled', job.proc.returncode)
+        else: job.set_state('exited', job.proc.returncode)
+
+JOB_MANAGER = JobManager(CONFIG['EXEC_MAX_JOBS'], CONFIG['EXEC_MAX_QUEUED'], CONFIG['EXEC_KEEP_JOBS'], CONFIG['EXEC_OUTPUT_BYTES'])
+
+# --- Roots ---
+class Root:
+    """
+    One served tree and everything kept per tree: ignore rules, the file
+    index and its lock, change journal, Merkle tree, search index, snapshot
+    state and polling cursor. The HTTP and read pools, content cache, event
+    hub, event coalescer, watchdog observer, poll thread and job manager
+    are shared by all roots.
+    """
+    def __init__(self, name, path):
+        self.name = name
+        self.dir = os.path.abspath(path)
+        self.ignore_dirs = set()
+        self.custom_patterns = set()
+        self.excluded_paths = set()
+        self.matcher = IgnoreMatcher((), (), ())
+        self.index = FileIndex()
+        self.lock = TimedLock()
+        # Serializes read-check-write sequences (patches) against other API writes
+        self.write_lock = TimedLock()
+        self.seq = 0
+        self.epoch = format(int(time.time() * 1000), 'x')
+        self.journal = deque(maxlen=CONFIG['JOURNAL_SIZE'])
+        self.merkle = MerkleTree(self.index)
+        self.search = TrigramIndex(self, CONFIG['SEARCH_INDEX'], CONFIG['SEARCH_MAX_FILE_BYTES'])
+        self.dir_mtimes = {}
+        self.snapshot = {'saved_cursor': None, 'reconciling': False}
+        self.poller = PollingScanner(self)
+        self.sorted_keys = {'key': None, 'keys': []}
+
+    def usage(self):
+        """What this root costs: index size and memory, lock waits, events, search, jobs and requests."""
+        with self.lock:
+            files, dirs, journal = len(self.index), len(self.index.dirs), len(self.journal)
+            index_bytes = self.index.memory_bytes()
+        requests, seconds, nbytes = METRICS.root_usage(self.name)
+        search = self.search.stats()
+        return {
+            "name": self.name, "path": self.dir, "files": files, "dirs": dirs, "journal_entries": journal,
+            "index_bytes": index_bytes, "search_bytes": search["memory_bytes"], "search_ready": search["ready"],
+            "reconciling": self.snapshot['reconciling'],
+            "lock": {"acquisitions": self.lock.acquisitions, "contended": self.lock.contended, "wait_seconds": round(self.lock.wait_seconds, 6)},
+            "events": EVENT_COALESCER.stats(self), "poll": self.poller.stats(), "jobs": JOB_MANAGER.stats(self),
+            "requests": {"count": requests, "seconds": round(seconds, 6), "bytes": nbytes}
+        }
+
+# name -> Root. The first root also answers the unprefixed /api/... routes.
+ROOTS = OrderedDict()
+ROOT_PREFIX = '/roots/'
+_ROOT_NAME_RE = re.compile(r'^[A-Za-z0-9_.-]+$')
+
+def add_root(name, path):
+    if not _ROOT_NAME_RE.match(name): raise ValueError(f"Bad root name: {name!r}")
+    if name in ROOTS: raise ValueError(f"Duplicate root name: {name}")
+    if not os.path.isdir(path): raise ValueError(f"Not a directory: {path}")
+    root = ROOTS[name] = Root(name, path)
+    return root
+
+def parse_roots(specs):
+    """["name=path" or "path", ...] -> [(name, path)]. Bare paths are named after their directory."""
+    roots = []
+    for spec in specs:
+        name, sep, path = spec.partition('=')
+        if not sep: name, path = os.path.basename(os.path.abspath(spec)), spec
+        roots.append((name.strip(), os.path.expanduser(path.strip())))
+    return roots
+
+def default_root():
+    return next(iter(ROOTS.values()), None)
+
+def split_root_path(path):
+    """'/roots/<name>/api/x' -> (that root, '/api/x'), anything else -> (default root, path). Unknown names give None."""
+    if not path.startswith(ROOT_PREFIX): return default_root(), path
+    name, _, rest = path[len(ROOT_PREFIX):].partition('/')
+    return ROOTS.get(name), '/' + rest
+
+def root_middleware(wsgi_app):
+    """Serves /roots/<name>/api/... as /api/... against that root; the root is left in environ['genclaude.root']."""
+    def routed(environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        root, rest = split_root_path(path)
+        if root is None:
+            body = json.dumps({"error": "Unknown root", "roots": list(ROOTS)}).encode('utf-8')
+            start_response('404 NOT FOUND', [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+            return [body]
+        if rest != path:
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + path[:len(path) - len(rest)]
+            environ['PATH_INFO'] = rest
+        environ['genclaude.root'] = root
+        return wsgi_app(environ, start_response)
+    return routed
+
+app.wsgi_app = root_middleware(app.wsgi_app)
+
+def current_root():
+    return request.environ['genclaude.root']
 
 # --- Routes ---
+@app.after_request
+def tag_route(response):
+    """Labels the request with its URL rule for /api/metrics (paths would explode the label set)."""
+    if request.url_rule is not None: request.environ['genclaude.route'] = request.url_rule.rule
+    return response
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(**labels):
+    return '{' + ','.join(f'{k}="{_label_value(v)}"' for k, v in labels.items()) + '}'
+
+def render_metrics():
+    requests, latency, nbytes, timings, root_usage = METRICS.snapshot()
+    roots = list(ROOTS.values())
+    out = []
+    def metric(name, kind, help_text, samples):
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+        for labels, value in samples: out.append(f"{name}{labels} {value}")
+
+    metric('genclaude_http_requests_total', 'counter', 'HTTP requests by route, method and status.',
+           [(_labels(route=r, method=m, status=st), n) for (r, m, st), n in sorted(requests.items())])
+    out.append("# HELP genclaude_http_request_duration_seconds Time to produce the full response (SSE streams excluded).")
+    out.append("# TYPE genclaude_http_request_duration_seconds histogram")
+    for (r, m), hist in sorted(latency.items()):
+        cumulative = 0
+        for le, count in zip([*(f"{b:g}" for b in METRICS.buckets), '+Inf'], hist[:-1]):
+            cumulative += count
+            out.append(f"genclaude_http_request_duration_seconds_bucket{_labels(route=r, method=m, le=le)} {cumulative}")
+        out.append(f"genclaude_http_request_duration_seconds_sum{_labels(route=r, method=m)} {hist[-1]}")
+        out.append(f"genclaude_http_request_duration_seconds_count{_labels(route=r, method=m)} {cumulative}")
+    metric('genclaude_http_response_bytes_total', 'counter', 'Response body bytes by route and method.',
+           [(_labels(route=r, method=m), n) for (r, m), n in sorted(nbytes.items())])
+
+    metric('genclaude_root_requests_total', 'counter', 'HTTP requests by root.', [(_labels(root=r), u[0]) for r, u in sorted(root_usage.items())])
+    metric('genclaude_root_request_seconds_total', 'counter', 'Time spent answering requests, by root.', [(_labels(root=r), u[1]) for r, u in sorted(root_usage.items())])
+    metric('genclaude_root_response_bytes_total', 'counter', 'Response body bytes by root.', [(_labels(root=r), u[2]) for r, u in sorted(root_usage.items())])
+
+    metric('genclaude_index_build_seconds', 'gauge', 'Duration of the last index build, by kind and root.',
+           [(_labels(kind=k, root=r or ''), v) for (k, r), v in sorted(timings.items(), key=lambda t: (t[0][0], t[0][1] or ''))])
+    metric('genclaude_index_files', 'gauge', 'Files in the index.', [(_labels(root=r.name), len(r.index)) for r in roots])
+    metric('genclaude_index_journal_entries', 'gauge', 'Changes kept for /api/list?since=.', [(_labels(root=r.name), len(r.journal)) for r in roots])
+    locks = [(r.name, n, l) for r in roots for n, l in (('index', r.lock), ('write', r.write_lock))]
+    metric('genclaude_lock_acquisitions_total', 'counter', 'Lock acquisitions.', [(_labels(root=r, lock=n), l.acquisitions) for r, n, l in locks])
+    metric('genclaude_lock_contended_total', 'counter', 'Acquisitions that had to wait.', [(_labels(root=r, lock=n), l.contended) for r, n, l in locks])
+    metric('genclaude_lock_wait_seconds_total', 'counter', 'Time spent waiting for locks.', [(_labels(root=r, lock=n), l.wait_seconds) for r, n, l in locks])
+
+    events = [(r.name, EVENT_COALESCER.stats(r)) for r in roots]
+    metric('genclaude_fs_events_total', 'counter', 'Raw watchdog events received.', [(_labels(root=r), e['raw']) for r, e in events])
+    metric('genclaude_fs_changes_total', 'counter', 'Index changes after coalescing.', [(_labels(root=r), e['coalesced']) for r, e in events])
+    metric('genclaude_fs_event_batches_total', 'counter', 'Coalesced batches applied.', [(_labels(root=r), e['batches']) for r, e in events])
+    metric('genclaude_fs_events_pending', 'gauge', 'Dirty paths waiting for the next flush.', [(_labels(root=r), e['pending']) for r, e in events])
+    with EVENT_HUB.lock: subscribers = [sub.root for sub in EVENT_HUB.subscribers]
+    metric('genclaude_sse_clients', 'gauge', 'Connected /api/events clients.', [(_labels(root=r.name), subscribers.count(r.name)) for r in roots])
+    metric('genclaude_sse_messages_total', 'counter', 'Messages published to /api/events.', [('', EVENT_HUB.last_seq)])
+
+    polls = [(r.name, r.poller.stats()) for r in roots]
+    metric('genclaude_poll_stat_calls_total', 'counter', 'Stat calls made by the polling scanner.', [(_labels(root=r), p['stat_calls']) for r, p in polls])
+    metric('genclaude_poll_rounds_total', 'counter', 'Completed polling rounds.',
+           [(_labels(root=r, kind=kind), p[f'{kind[:-1]}_rounds']) for r, p in polls for kind in ('dirs', 'files')])
+    jobs = JOB_MANAGER.stats()
+    metric('genclaude_exec_jobs', 'gauge', 'Exec jobs by state.', [(_labels(state='running'), jobs['running']), (_labels(state='queued'), jobs['queued'])])
+    cache = CONTENT_CACHE.stats()
+    metric('genclaude_cache_bytes', 'gauge', 'Bytes held by the content cache.', [('', cache['bytes'])])
+    metric('genclaude_cache_requests_total', 'counter', 'Content cache lookups.', [(_labels(result='hit'), cache['hits']), (_labels(result='miss'), cache['misses'])])
+    metric('genclaude_cache_evictions_total', 'counter', 'Content cache evictions.', [('', cache['evictions'])])
+    lines = LINE_INDEXES.stats()
+    metric('genclaude_line_index_builds_total', 'counter', 'Line indexes built for /api/read-range.', [('', lines['builds'])])
+    metric('genclaude_line_index_build_seconds_total', 'counter', 'Time spent building line indexes.', [('', lines['build_seconds'])])
+    return '\n'.join(out) + '\n'
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/health', methods=['GET'])
 def health():
-    return jsonify({"status": "ok", "root": os.path.basename(CONFIG['ROOT_DIR']), "capabilities": {"exec": True, "watch": HAS_WATCHDOG}, "indexed_files": len(FILE_INDEX)})
+    root = current_root()
+    return jsonify({"status": "ok", "root": os.path.basename(root.dir), "name": root.name, "roots": list(ROOTS), "capabilities": {"exec": True, "watch": HAS_WATCHDOG or POLL_STATE['running']}, "indexed_files": len(root.index), "reconciling": root.snapshot['reconciling'], "events": EVENT_COALESCER.stats(root), "cache": CONTENT_CACHE.stats(), "line_index": LINE_INDEXES.stats(), "jobs": JOB_MANAGER.stats(root), "poll": root.poller.stats()})
+
+@app.route('/api/roots', methods=['GET'])
+def list_roots():
+    """Every served root with what it costs (index memory, lock waits, events, requests...). Use /roots/<name>/api/... to address one."""
+    return jsonify({"default": default_root().name, "roots": [root.usage() for root in ROOTS.values()]})
+
+def format_hub_events(events, resync_id):
+    """SSE text for what Subscriber.pull returned ('' if nothing)."""
+    parts = []
+    if resync_id is not None: parts.append(f"id: {resync_id}\ndata: {json.dumps({'type': 'resync', 'timestamp': time.time()})}\n\n")
+    for event_id, data in events: parts.append(f"id: {event_id}\ndata: {data}\n\n")
+    return ''.join(parts)
+
+def format_job_output(job, after, chunks, dropped, done):
+    """SSE text for what Job.output_after returned. Returns (text, last seq sent, finished)."""
+    parts = []
+    if dropped: parts.append(f"data: {json.dumps({'type': 'truncated', 'after': after})}\n\n")
+    for seq, name, text in chunks:
+        parts.append(f"id: {seq}\ndata: {json.dumps({'type': 'output', 'stream': name, 'text': text})}\n\n")
+        after = seq
+    if done: parts.append(f"data: {json.dumps({'type': 'exit', **job.info()})}\n\n")
+    return ''.join(parts), after, done
 
 @app.route('/api/events')
 def sse_events():
+    """
+    Server-sent change events. Reconnecting clients send Last-Event-ID and
+    get what they missed; if that is no longer available (or the client
+    fell too far behind) they get a {"type": "resync"} message and should
+    re-list with /api/list?since=<cursor>.
+    """
+    sub = EVENT_HUB.subscribe(request.headers.get('Last-Event-ID') or request.args.get('lastEventId'), current_root().name)
     def stream():
-        while True:
-            try:
-                data = event_queue.get(timeout=5)
-                yield f"data: {json.dumps(data)}\n\n"
-            except: yield ": keep-alive\n\n"
-    return Response(stream(), mimetype='text/event-stream')
+        try:
+            yield ": connected\n\n"
+            while True:
+                yield format_hub_events(*sub.pull(timeout=5)) or ": keep-alive\n\n"
+        finally:
+            EVENT_HUB.unsubscribe(sub)
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def _sorted_index_keys(root):
+    """Sorted snapshot of index paths, reused while the index is unchanged."""
+    with root.lock:
+        key = make_cursor(root)
+        if root.sorted_keys['key'] == key: return root.sorted_keys['keys']
+        keys = list(root.index)
+    keys.sort()
+    root.sorted_keys['key'], root.sorted_keys['keys'] = key, keys
+    return keys
+
+def _add_hashes(root, records):
+    """Fills in "hash" for listing records, hashing files on the read pool where needed."""
+    def fill(record):
+        try: record["hash"] = content_hash(root, record["path"])
+        except OSError: record["hash"] = None
+    for record in records:
+        if record.get("op", "upsert") != "upsert": continue
+        digest = indexed_hash(root, record["path"], record["size"], record["mtime"])
+        if digest: record["hash"] = digest
+    list(READ_POOL.map(fill, [r for r in records if "hash" not in r and r.get("op", "upsert") == "upsert"]))
+    return records
+
+def _list_page(root, after, limit, cursor):
+    keys = _sorted_index_keys(root)
+    start = bisect.bisect_right(keys, after) if after else 0
+    page_keys = keys[start:start + limit]
+    with root.lock:
+        if cursor is None: cursor = make_cursor(root)
+        entries = [(k, root.index.stats(k)) for k in page_keys]
+    files = [{"path": k, "size": v[0], "mtime": v[1]} for k, v in entries if v is not None]
+    has_more = start + limit < len(keys)
+    return {"files": files, "cursor": cursor, "next": page_keys[-1] if has_more and page_keys else None}
 
 @app.route('/api/list', methods=['GET'])
 def list_files():
-    with INDEX_LOCK:
-        return jsonify({"files": [{"path": k, "size": v["size"], "mtime": v.get("mtime", 0)} for k, v in FILE_INDEX.items()]})
+    """
+    Lists indexed files.
+
+    - no args: full listing plus a cursor
+    - ?since=<cursor>: only changes after the cursor; falls back to a
+      paged full listing with "reset": true when the cursor has expired
+    - ?limit=N&after=<path>&cursor=<cursor>: paged full listing ordered by
+      path. Pass the cursor from the first page to later pages, then
+      poll with since=<cursor> to pick up anything that changed meanwhile.
+    - &hashes=1 with any of the above adds each file's content hash
+    """
+    root = current_root()
+    since = request.args.get('since')
+    limit = request.args.get('limit', type=int)
+    hashes = request.args.get('hashes') in ('1', 'true')
+    if since:
+        with root.lock:
+            changes = journal_since(root, since)
+            cursor = make_cursor(root)
+        if changes is not None:
+            return jsonify({"changes": _add_hashes(root, changes) if hashes else changes, "cursor": cursor})
+        page = _list_page(root, None, limit or CONFIG['LIST_PAGE_SIZE'], None)
+        page["reset"] = True
+    elif limit:
+        page = _list_page(root, request.args.get('after'), max(1, limit), request.args.get('cursor'))
+    else:
+        with root.lock:
+            cursor = make_cursor(root)
+            rows = list(root.index.iter_stats())
+        page = {"files": [{"path": k, "size": size, "mtime": mtime} for k, size, mtime in rows], "cursor": cursor}
+    if hashes: _add_hashes(root, page["files"])
+    return jsonify(page)
+
+@app.route('/api/tree', methods=['GET'])
+def tree_node():
+    """
+    Merkle hashes for reconciling a mirror: ?path=<dir> returns the
+    directory's hash plus the hashes of its subdirectories and files.
+    Start at the root and descend only where hashes differ. See
+    MerkleTree for how to compute the same hashes client side.
+    """
+    rel_dir = request.args.get('path', '').strip('/')
+    if rel_dir == '.': rel_dir = ''
+    root = current_root()
+    with root.lock: node = root.merkle.node(rel_dir)
+    if node is None: return jsonify({"error": "No indexed files under path"}), 404
+    return jsonify(node)
+
+def _search_text(root, rel_path):
+    """File text for a search scan. Uses the content cache but does not fill it."""
+    full_path = os.path.join(root.dir, rel_path)
+    st = os.stat(full_path)
+    cached = CONTENT_CACHE.get(full_path, st.st_size, st.st_mtime_ns)
+    if cached is not None: return cached[0]
+    with open(full_path, 'r', encoding='utf-8', errors='replace') as f: return f.read()
+
+@app.route('/api/search', methods=['POST'])
+def search():
+    """
+    Searches file contents. Body: {"query", "regex": false, "ignore_case": false,
+    "limit": 100, "paths": [glob, ...]}. Candidates come from the trigram
+    index when the query has a literal of 3+ characters, otherwise every
+    indexed file is scanned. Returns matching lines with 1-based numbers.
+    """
+    root = current_root()
+    data = request.json
+    query = data.get('query')
+    if not query: return jsonify({"error": "No query"}), 400
+    limit = max(1, min(int(data.get('limit', 100)), 10000))
+    flags = re.IGNORECASE if data.get('ignore_case') else 0
+    try:
+        if data.get('regex'):
+            matcher = re.compile(query, flags)
+            literals = [] if flags else required_literals(query)
+        else:
+            matcher = re.compile(re.escape(query), flags)
+            literals = [query]
+    except re.error as e: return jsonify({"error": f"Bad regex: {e}"}), 400
+    literal = None if data.get('regex') or flags else query
+    path_globs = data.get('paths') or []
+    path_re = re.compile('|'.join(f"(?:{fnmatch.translate(g)})" for g in path_globs)) if path_globs else None
+
+    start = time.perf_counter()
+    candidates = root.search.candidates(literals)
+    used_index = candidates is not None
+    if candidates is None:
+        with root.lock: candidates = list(root.index)
+    candidates = sorted(p for p in candidates if path_re is None or path_re.match(p))
+
+    matches, scanned, truncated = [], 0, False
+    for rel_path in candidates:
+        try: content = _search_text(root, rel_path)
+        except OSError: continue
+        scanned += 1
+        if literal is not None and literal not in content: continue
+        for line_no, line in enumerate(content.split('\n'), 1):
+            if matcher.search(line):
+                matches.append({"path": rel_path, "line": line_no, "text": line[:500]})
+                if len(matches) >= limit: break
+        if len(matches) >= limit:
+            truncated = True
+            break
+    return jsonify({"matches": matches, "truncated": truncated, "candidates": len(candidates), "files_scanned": scanned,
+                    "used_index": used_index, "took_ms": round((time.perf_counter() - start) * 1000, 2)})
+
+@app.route('/api/search/stats', methods=['GET'])
+def search_stats():
+    return jsonify(current_root().search.stats())
 
 @app.route('/api/read', methods=['POST'])
 def read_file():
+    """
+    Reads one file. The response carries its content hash (also as ETag).
+    A client that already has a version sends it as "hash" in the body, or
+    as If-None-Match, and gets {"unchanged": true} / 304 instead of content.
+    """
     rel_path = request.json.get('path')
     if not rel_path: return jsonify({"error": "No path"}), 400
-    full_path = os.path.join(CONFIG['ROOT_DIR'], rel_path)
+    etags = [t.strip().removeprefix('W/').strip('"') for t in request.headers.get('If-None-Match', '').split(',') if t.strip()]
+    known_hash = request.json.get('hash') or (etags[0] if len(etags) == 1 else None)
     try:
-        if os.path.exists(full_path) and os.path.getsize(full_path) > CONFIG['MAX_FILE_SIZE']:
-             return jsonify({"error": "File too large to read"}), 400
+        content, digest = read_text(current_root(), rel_path, known_hash)
+        if digest in etags:
+            response = make_response('', 304)
+        elif content is None:
+            response = jsonify({"path": rel_path, "hash": digest, "unchanged": True})
+        else:
+            response = jsonify({"path": rel_path, "content": content, "hash": digest})
+        response.headers['ETag'] = f'"{digest}"'
+        return response
+    except FileTooLarge as e: return jsonify({"error": str(e)}), 400
+    except Exception as e: return jsonify({"error": str(e)}), 500
 
-        with open(full_path, 'r', encoding='utf-8', errors='replace') as f:
-            return jsonify({"path": rel_path, "content": f.read()})
+@app.route('/api/read-range', methods=['POST'])
+def read_file_range():
+    """
+    Reads part of a file, with no MAX_FILE_SIZE limit. Body: {"path"} plus
+    "offset"/"length" in bytes, or "start_line"/"end_line" (1-based,
+    inclusive). Line reads also return "total_lines"; a window starting
+    past the end is empty, with end_line = start_line - 1. "truncated" is
+    set when RANGE_MAX_BYTES cut the reply short.
+    """
+    data = request.json
+    rel_path = data.get('path')
+    if not rel_path: return jsonify({"error": "No path"}), 400
+    try:
+        return jsonify(read_range(current_root(), rel_path, data.get('offset'), data.get('length'), data.get('start_line'), data.get('end_line')))
+    except (ValueError, TypeError) as e: return jsonify({"error": f"Bad range: {e}"}), 400
+    except FileNotFoundError: return jsonify({"error": "No such file"}), 404
     except Exception as e: return jsonify({"error": str(e)}), 500
 
 @app.route('/api/batch-read', methods=['POST'])
 def batch_read():
-    paths = request.json.get('paths', [])
-    results = []
-    for rel_path in paths:
-        full_path = os.path.join(CONFIG['ROOT_DIR'], rel_path)
-        try:
-            if os.path.exists(full_path) and os.path.getsize(full_path) <= CONFIG['MAX_FILE_SIZE']:
-                with open(full_path, 'r', encoding='utf-8', errors='replace') as f:
-                    results.append({"path": rel_path, "content": f.read()})
-        except: pass
-    return jsonify({"files": results})
+    """
+    Reads many files. With "stream": true (or Accept: application/x-ndjson)
+    the response is NDJSON, one {"path", "content"} or {"path", "error"}
+    record per file, written as soon as each file is read. "known" maps
+    paths to hashes the client already has; those come back as
+    {"path", "hash", "unchanged": true}.
+    """
+    root = current_root()
+    data = request.json
+    paths = data.get('paths', [])
+    known = data.get('known') or {}
+    if data.get('stream') or 'application/x-ndjson' in request.headers.get('Accept', ''):
+        return Response((json.dumps(r) + "\n" for r in iter_batch_read(root, paths, known)), mimetype='application/x-ndjson')
+
+    results, errors = [], []
+    for record in READ_POOL.map(lambda p: read_record(root, p, known.get(p)), paths):
+        (errors if "error" in record else results).append(record)
+    return jsonify({"files": results, "errors": errors})
 
 @app.route('/api/write', methods=['POST'])
 def write_file():
@@ -458,30 +2740,112 @@ def write_file():
     rel_path = data.get('path')
     content = data.get('content')
     if not rel_path or content is None: return jsonify({"error": "Missing args"}), 400
-    full_path = os.path.join(CONFIG['ROOT_DIR'], rel_path)
     try:
-        os.makedirs(os.path.dirname(full_path), exist_ok=True)
-        with open(full_path, 'w', encoding='utf-8', newline='\n') as f: f.write(content)
-        try:
-            stats = os.stat(full_path)
-            with INDEX_LOCK: FILE_INDEX[rel_path] = { "size": stats.st_size, "mtime": stats.st_mtime }
-        except: pass
+        root = current_root()
+        with root.write_lock: store_file(root, rel_path, content.encode('utf-8'))
         return jsonify({"status": "ok", "path": rel_path})
     except Exception as e: return jsonify({"error": str(e)}), 500
 
+@app.route('/api/patch', methods=['POST'])
+def patch_file():
+    """
+    Applies an edit against a known version of a file instead of uploading
+    all of it. Body: {"path", "base_hash", "patch": <unified diff>} or
+    {"path", "base_hash", "delta": [{"copy": [offset, length]}, {"data": text}, ...]}.
+    Returns 409 with the current hash if the file no longer matches
+    base_hash, 422 if the patch does not apply.
+    """
+    data = request.json
+    rel_path = data.get('path')
+    base_hash = data.get('base_hash')
+    if not rel_path or not base_hash or ('patch' not in data and 'delta' not in data):
+        return jsonify({"error": "Missing args"}), 400
+    root = current_root()
+    full_path = os.path.join(root.dir, rel_path)
+    try:
+        with root.write_lock:
+            try:
+                with open(full_path, 'rb') as f: base = f.read()
+            except FileNotFoundError: return jsonify({"error": "No such file"}), 404
+            current = hash_bytes(base)
+            if current != base_hash:
+                return jsonify({"error": "Base has changed", "hash": current}), 409
+            try:
+                if 'patch' in data:
+                    try: text = base.decode('utf-8')
+                    except UnicodeDecodeError: raise PatchError("Base is not valid UTF-8 text")
+                    new_data = apply_unified_diff(text, data['patch']).encode('utf-8')
+                else:
+                    new_data = apply_block_delta(base, data['delta'])
+            except (PatchError, ValueError, TypeError, KeyError) as e:
+                return jsonify({"error": f"Patch rejected: {e}", "hash": current}), 422
+            digest = store_file(root, rel_path, new_data)
+        return jsonify({"status": "ok", "path": rel_path, "hash": digest, "size": len(new_data)})
+    except Exception as e: return jsonify({"error": str(e)}), 500
+
+@app.route('/api/batch-write', methods=['POST'])
+def batch_write():
+    """
+    Writes and moves many files as one transaction. Body:
+    {"files": [{"path", "content"}], "moves": [{"source", "destination"}]}.
+    Writes are applied first, then moves, in order. Either everything
+    lands or the tree is rolled back; the index is updated in one step
+    and clients get one batched change event.
+    """
+    data = request.json
+    files = data.get('files', [])
+    moves = data.get('moves', [])
+    if any(not f.get('path') or f.get('content') is None for f in files) or any(not m.get('source') or not m.get('destination') for m in moves):
+        return jsonify({"error": "Missing args"}), 400
+    root = current_root()
+
+    with root.write_lock:
+        staged = []
+        txn = BatchTransaction()
+        try:
+            for f in files:
+                full_path = os.path.join(root.dir, f['path'])
+                txn.makedirs(os.path.dirname(full_path))
+                staged.append((stage_file(full_path, f['content'].encode('utf-8'), sync=True), full_path))
+            for tmp_path, full_path in staged: txn.replace(tmp_path, full_path)
+            staged = []
+            moved = []
+            for m in moves:
+                full_src = os.path.join(root.dir, m['source'])
+                was_dir = os.path.isdir(full_src)
+                moved.append((m['source'].rstrip('/'), txn.move(full_src, os.path.join(root.dir, m['destination'])), was_dir))
+        except Exception as e:
+            for tmp_path, _ in staged:
+                try: os.remove(tmp_path)
+                except OSError: pass
+            errors = txn.rollback()
+            return jsonify({"error": str(e), "rolled_back": not errors, "rollback_errors": errors}), 500
+        txn.commit()
+
+        changes = {}
+        for src, target, was_dir in moved: changes.update(move_changes(root, src, target, was_dir))
+        for f in files:
+            full_path = os.path.join(root.dir, f['path'])
+            # A later move may have taken the file away again
+            if os.path.exists(full_path): changes[f['path']] = stat_for_index(full_path)
+        apply_index_changes(root, changes)
+    return jsonify({"status": "ok", "written": len(files), "moved": len(moves)})
+
 @app.route('/api/delete', methods=['POST'])
 def delete_item():
     data = request.json
     rel_path = data.get('path')
     if not rel_path: return jsonify({"error": "No path"}), 400
-    full_path = os.path.join(CONFIG['ROOT_DIR'], rel_path)
+    root = current_root()
+    full_path = os.path.join(root.dir, rel_path)
     try:
-        if os.path.isdir(full_path):
+        is_dir = os.path.isdir(full_path)
+        if is_dir:
             shutil.rmtree(full_path)
         elif os.path.exists(full_path):
             os.remove(full_path)
-        with INDEX_LOCK:
-            if rel_path in FILE_INDEX: del FILE_INDEX[rel_path]
+        with root.lock: removed = index_paths_under(root, rel_path) if is_dir else [rel_path]
+        apply_index_changes(root, {k: None for k in removed})
         return jsonify({"status": "ok"})
     except Exception as e: return jsonify({"error": str(e)}), 500
 
@@ -491,30 +2855,373 @@ def move_item():
     src = data.get('source')
     dst = data.get('destination')
     if not src or not dst: return jsonify({"error": "Missing args"}), 400
-    full_src = os.path.join(CONFIG['ROOT_DIR'], src)
-    full_dst = os.path.join(CONFIG['ROOT_DIR'], dst)
+    root = current_root()
+    full_src = os.path.join(root.dir, src)
+    full_dst = os.path.join(root.dir, dst)
     try:
+        was_dir = os.path.isdir(full_src)
+        target = moved_target(full_src, full_dst)
         os.makedirs(os.path.dirname(full_dst), exist_ok=True)
         shutil.move(full_src, full_dst)
+        apply_index_changes(root, move_changes(root, src.rstrip('/'), target, was_dir))
         return jsonify({"status": "ok"})
     except Exception as e: return jsonify({"error": str(e)}), 500
 
+def _exec_timeout(data):
+    try: timeout = float(data.get('timeout') or CONFIG['EXEC_TIMEOUT'])
+    except (TypeError, ValueError): timeout = CONFIG['EXEC_TIMEOUT']
+    return max(1, min(timeout, CONFIG['EXEC_MAX_TIMEOUT']))
+
+def _submit_job(data):
+    cmd = data.get('command')
+    if not cmd: return None, (jsonify({"error": "No command"}), 400)
+    try: return JOB_MANAGER.submit(current_root(), cmd, _exec_timeout(data)), None
+    except JobQueueFull: return None, (jsonify({"error": "Too many queued commands"}), 429)
+
 @app.route('/api/exec', methods=['POST'])
 def exec_cmd():
-    cmd = request.json.get('command')
-    if not cmd: return jsonify({"error": "No command"}), 400
-    try:
-        result = subprocess.run(cmd, shell=True, cwd=CONFIG['ROOT_DIR'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=30)
-        return jsonify({"stdout": result.stdout, "stderr": result.stderr, "code": result.returncode})
-    except Exception as e: return jsonify({"error": str(e)}), 500
+    """
+    Runs a command. With "async": true returns 202 and the job (see
+    /api/jobs); otherwise waits for it and returns stdout/stderr/code.
+    """
+    data = request.json
+    job, error = _submit_job(data)
+    if error: return error
+    if data.get('async'): return jsonify(job.info()), 202
+    with job.cond:
+        while not job.done: job.cond.wait()
+    chunks, dropped, _ = job.output_after(0)
+    out = {"stdout": ''.join(t for _, name, t in chunks if name == 'stdout'),
+           "stderr": ''.join(t for _, name, t in chunks if name == 'stderr'), "code": job.code, "job": job.id}
+    if dropped: out["truncated"] = True
+    if job.state == 'failed': return jsonify({"error": out["stderr"]}), 500
+    if job.state == 'timeout': out["error"] = f"Command timed out after {job.timeout:g} seconds"
+    return jsonify(out)
+
+@app.route('/api/jobs', methods=['GET', 'POST'])
+def jobs():
+    if request.method == 'GET':
+        root = current_root()
+        return jsonify({"jobs": JOB_MANAGER.list(root), **JOB_MANAGER.stats(root)})
+    job, error = _submit_job(request.json)
+    if error: return error
+    return jsonify(job.info()), 202
+
+def _root_job(job_id):
+    """The job, if it was started under the requested root."""
+    job = JOB_MANAGER.get(job_id)
+    return job if job and job.root is current_root() else None
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = _root_job(job_id)
+    if not job: return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.info())
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def job_cancel(job_id):
+    job = _root_job(job_id) and JOB_MANAGER.cancel(job_id)
+    if not job: return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.info())
+
+@app.route('/api/jobs/<job_id>/output', methods=['GET'])
+def job_output(job_id):
+    """
+    Job output after chunk ?after=<seq>. As an SSE stream when the client
+    accepts text/event-stream (resumable with Last-Event-ID), else one JSON
+    reply, long-polling up to ?wait= seconds for new output.
+    """
+    job = _root_job(job_id)
+    if not job: return jsonify({"error": "Unknown job"}), 404
+    try: after = int(request.headers.get('Last-Event-ID') or request.args.get('after', 0))
+    except ValueError: after = 0
+
+    if 'text/event-stream' not in request.headers.get('Accept', ''):
+        wait = max(0.0, min(float(request.args.get('wait', 0) or 0), 30.0))
+        chunks, dropped, done = job.output_after(after, wait)
+        return jsonify({"chunks": [{"seq": seq, "stream": name, "text": text} for seq, name, text in chunks],
+                        "dropped": dropped, "done": done, "job": job.info()})
+
+    def stream():
+        nonlocal after
+        yield ": connected\n\n"
+        while True:
+            text, after, finished = format_job_output(job, after, *job.output_after(after, 5))
+            yield text or ": keep-alive\n\n"
+            if finished: return
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# --- Asyncio Server ---
+_JOB_OUTPUT_RE = re.compile(r'^/api/jobs/([^/]+)/output$')
+
+class BodyTooLarge(Exception): pass
+
+class AsyncServer:
+    """
+    HTTP/1.1 keep-alive server on asyncio (GENCLAUDE_SERVER=asyncio). SSE
+    streams are coroutines woken by the event hub or job instead of parked
+    threads; every other request runs the Flask app on a bounded thread
+    pool, so routes behave exactly as under app.run().
+    """
+    def __init__(self, wsgi_app, host, port, workers):
+        self.app = wsgi_app
+        self.host, self.port = host, port
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='http')
+        self.loop = None
+        self.server = None
+        self.connections = 0
+        self.streams = 0
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self.handle, self.host, self.port, limit=65536, reuse_address=True)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server: await self.server.serve_forever()
+
+    def reject(self, writer, status):
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode('latin-1'))
+
+    async def read(self, pending):
+        """One read from the client, given up after HTTP_IDLE_TIMEOUT seconds without data."""
+        return await asyncio.wait_for(pending, CONFIG['HTTP_IDLE_TIMEOUT'])
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        max_body = CONFIG['HTTP_MAX_BODY']
+        try:
+            while True:
+                try: head = await self.read(reader.readuntil(b'\r\n\r\n'))
+                except asyncio.LimitOverrunError:
+                    self.reject(writer, '431 Request Header Fields Too Large')
+                    return
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError): return
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ')
+                    if not version.startswith('HTTP/'): raise ValueError(version)
+                    headers = {}
+                    for line in lines[1:]:
+                        if not line: continue
+                        name, sep, value = line.partition(':')
+                        if not sep or not name.strip(): raise ValueError(line)
+                        name, value = name.strip().lower(), value.strip()
+                        headers[name] = f"{headers[name]}, {value}" if name in headers else value
+                    chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+                    length = 0 if chunked else int(headers.get('content-length') or 0)
+                    if length < 0: raise ValueError(length)
+                except ValueError:
+                    self.reject(writer, '400 Bad Request')
+                    return
+                if length > max_body:
+                    self.reject(writer, '413 Payload Too Large')
+                    return
+                if headers.get('expect', '').lower() == '100-continue': writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+                try: body = await (self.read_chunked(reader, max_body) if chunked else self.read_body(reader, length))
+                except ValueError:
+                    self.reject(writer, '400 Bad Request')
+                    return
+                except BodyTooLarge:
+                    self.reject(writer, '413 Payload Too Large')
+                    return
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+                path, _, query = target.partition('?')
+                stream = self.stream_for(method, path, query, headers)
+                if stream is not None:
+                    await self.send_stream(reader, writer, stream, headers)
+                    return
+                if not await self.send_wsgi(writer, method, path, query, headers, body, version, keep_alive): return
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.CancelledError, ValueError): pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def read_body(self, reader, length):
+        body = bytearray()
+        while len(body) < length: body += await self.read(reader.readexactly(min(length - len(body), 65536)))
+        return bytes(body)
+
+    async def read_chunked(self, reader, max_body):
+        body = bytearray()
+        while True:
+            size = int((await self.read(reader.readline())).split(b';')[0].strip() or b'0', 16)
+            if size < 0: raise ValueError(size)
+            if size == 0:
+                while (await self.read(reader.readline())).strip(): pass
+                return bytes(body)
+            if len(body) + size > max_body: raise BodyTooLarge(len(body) + size)
+            body += await self.read_body(reader, size)
+            await self.read(reader.readexactly(2))
+
+    # SSE routes served as coroutines
+    def stream_for(self, method, path, query, headers):
+        if method != 'GET': return None
+        root, path = split_root_path(path)
+        if root is None: return None
+        args = parse_qs(query)
+        if path == '/api/events':
+            return self.hub_stream(headers.get('last-event-id') or args.get('lastEventId', [None])[0], root)
+        match = _JOB_OUTPUT_RE.match(path)
+        if match and 'text/event-stream' in headers.get('accept', ''):
+            job = JOB_MANAGER.get(unquote(match.group(1)))
+            if job is None or job.root is not root: return None  # the Flask route sends the 404
+            try: after = int(headers.get('last-event-id') or args.get('after', ['0'])[0])
+            except ValueError: after = 0
+            return self.job_stream(job, after)
+        return None
+
+    async def hub_stream(self, last_event_id, root):
+        wake = asyncio.Event()
+        sub = EVENT_HUB.subscribe(last_event_id, root.name)
+        sub.waker = lambda: self.loop.call_soon_threadsafe(wake.set)
+        try:
+            yield ": connected\n\n"
+            while True:
+                wake.clear()
+                text = format_hub_events(*sub.pull(timeout=0))
+                if text:
+                    yield text
+                    continue
+                try: await asyncio.wait_for(wake.wait(), 5)
+                except asyncio.TimeoutError: yield ": keep-alive\n\n"
+        finally:
+            EVENT_HUB.unsubscribe(sub)
+
+    async def job_stream(self, job, after):
+        wake = asyncio.Event()
+        waker = lambda: self.loop.call_soon_threadsafe(wake.set)
+        job.wakers.add(waker)
+        try:
+            yield ": connected\n\n"
+            while True:
+                wake.clear()
+                text, after, finished = format_job_output(job, after, *job.output_after(after))
+                if text: yield text
+                if finished: return
+                if text: continue
+                try: await asyncio.wait_for(wake.wait(), 5)
+                except asyncio.TimeoutError: yield ": keep-alive\n\n"
+        finally:
+            job.wakers.discard(waker)
+
+    async def send_stream(self, reader, writer, stream, headers):
+        self.streams += 1
+        head = ("HTTP/1.1 200 OK\r\nContent-Type: text/event-stream; charset=utf-8\r\n"
+                "Cache-Control: no-cache\r\nX-Accel-Buffering: no\r\nConnection: close\r\n")
+        if 'origin' in headers: head += f"Access-Control-Allow-Origin: {headers['origin']}\r\n"
+
+        async def pump():
+            writer.write((head + "\r\n").encode())
+            async for text in stream:
+                writer.write(text.encode())
+                await writer.drain()
+
+        async def drain_until_eof():
+            # Whatever the client sends on a stream is dropped, a piece at a time
+            while await reader.read(1024): pass
+
+        # Stop as soon as the client hangs up rather than at the next write
+        pumping, hangup = asyncio.ensure_future(pump()), asyncio.ensure_future(drain_until_eof())
+        try:
+            await asyncio.wait({pumping, hangup}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (pumping, hangup): task.cancel()
+            await asyncio.gather(pumping, hangup, return_exceptions=True)
+            await stream.aclose()
+            self.streams -= 1
+
+    # Everything else goes through the WSGI app
+    def environ(self, writer, method, path, query, headers, body, version):
+        environ = {
+            'REQUEST_METHOD': method, 'SCRIPT_NAME': '', 'PATH_INFO': unquote_to_bytes(path).decode('latin-1'),
+            'QUERY_STRING': query, 'SERVER_NAME': self.host, 'SERVER_PORT': str(self.port), 'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': (writer.get_extra_info('peername') or ('', 0))[0],
+            'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(body), 'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+            'CONTENT_LENGTH': str(len(body))
+        }
+        for name, value in headers.items():
+            if name == 'content-type': environ['CONTENT_TYPE'] = value
+            elif name not in ('content-length', 'transfer-encoding'): environ['HTTP_' + name.upper().replace('-', '_')] = value
+        return environ
+
+    def run_app(self, environ):
+        response = []
+        def start_response(status, headers, exc_info=None):
+            response[:] = [status, headers]
+            return lambda data: None
+        result = self.app(environ, start_response)
+        it = iter(result)
+        chunks, done = self.pull_chunks(it)
+        return response[0], response[1], result, it, chunks, done
+
+    def pull_chunks(self, it, max_bytes=256 * 1024, max_wait=0.01):
+        """Next body chunks; flushes after `max_wait` so streamed replies stay incremental."""
+        chunks, size, start = [], 0, time.time()
+        for chunk in it:
+            if chunk:
+                chunks.append(chunk)
+                size += len(chunk)
+            if size >= max_bytes or time.time() - start >= max_wait: return chunks, False
+        return chunks, True
+
+    async def send_wsgi(self, writer, method, path, query, headers, body, version, keep_alive):
+        environ = self.environ(writer, method, path, query, headers, body, version)
+        try: status, response_headers, result, it, chunks, done = await self.loop.run_in_executor(self.pool, self.run_app, environ)
+        except Exception as e:
+            print(f"{C_RED}[HTTP] {method} {path} failed: {e}{C_RESET}")
+            writer.write(b"HTTP/1.1 500 Internal Server Error\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            return False
+        try:
+            no_body = method == 'HEAD' or status[:3] in ('204', '304')
+            has_length = any(name.lower() == 'content-length' for name, _ in response_headers)
+            chunked = not has_length and not no_body and version == 'HTTP/1.1'
+            if not has_length and not no_body and not chunked: keep_alive = False
+            head = [f"HTTP/1.1 {status}"] + [f"{name}: {value}" for name, value in response_headers
+                                            if name.lower() not in ('connection', 'transfer-encoding')]
+            if chunked: head.append("Transfer-Encoding: chunked")
+            head.append("Connection: keep-alive" if keep_alive else "Connection: close")
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1'))
+            while True:
+                for chunk in chunks:
+                    writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk) if chunked else chunk)
+                await writer.drain()
+                if done: break
+                chunks, done = await self.loop.run_in_executor(self.pool, self.pull_chunks, it)
+            if chunked: writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            if hasattr(result, 'close'): result.close()
+        return keep_alive
+
+def serve_async(port):
+    server = AsyncServer(app, '127.0.0.1', port, CONFIG['HTTP_WORKERS'])
+    asyncio.run(server.serve_forever())
 
 if __name__ == '__main__':
-    run_interactive_selector()
+    # Roots: "name=path" or "path" arguments, else GENCLAUDE_ROOTS, else the current directory
+    specs = sys.argv[1:] or [s for s in CONFIG['ROOTS'].split(',') if s.strip()] or [os.getcwd()]
+    try:
+        for name, path in parse_roots(specs): add_root(name, path)
+    except ValueError as e:
+        print(f"{C_RED}✖ {e}{C_RESET}")
+        sys.exit(1)
+    if len(ROOTS) == 1: run_interactive_selector(default_root())
+    else:
+        for root in ROOTS.values(): load_root_rules(root)
 
     clear_screen()
     print(f"\n{C_CYAN}🚀 Starting GenClaude Server...{C_RESET}")
-    build_index()
+    for root in ROOTS.values():
+        start_index(root)
+        root.search.start()
     observer = start_observer()
+    start_poller()
+    start_snapshot_saver()
     print(f"\n{C_CYAN}💫 GenClaude Server V14.8 Running{C_RESET}")
 
     if HAS_NGROK and (NGROK_AUTH_TOKEN or os.environ.get("NGROK_AUTHTOKEN")):
@@ -523,11 +3230,16 @@ if __name__ == '__main__':
             print(f" {C_GREEN}✔ Ngrok: {C_BOLD}{ngrok.connect(8001).public_url}{C_RESET}")
         except: pass
 
-    print(f" {C_GREEN}✔ Local: {C_BOLD}http://127.0.0.1:8000{C_RESET}")
+    print(f" {C_GREEN}✔ Local: {C_BOLD}http://127.0.0.1:8000{C_RESET} ({CONFIG['SERVER_MODE']} server)")
+    if len(ROOTS) > 1:
+        for root in ROOTS.values(): print(f"   {C_GREY}{ROOT_PREFIX}{root.name}/api  →  {root.dir}{C_RESET}")
     print(f"\n{C_CYAN}{'='*70}{C_RESET}")
     print(f" {C_GREEN}✨ Server is running! Press Ctrl+C to stop.{C_RESET}")
     print(f"{C_CYAN}{'='*70}{C_RESET}\n")
 
-    try: app.run(port=8001, debug=False, threaded=True)
+    try:
+        if CONFIG['SERVER_MODE'] == 'asyncio': serve_async(8001)
+        else: app.run(port=8001, debug=False, threaded=True)
     finally:
         if observer: observer.stop(); observer.join()
+        for root in ROOTS.values(): save_index_snapshot(root)